@@ -1,31 +1,368 @@
 # app.py - Main Flask application for Keg Tap Management
-from flask import Flask, render_template, request, redirect, url_for, jsonify, send_from_directory, send_file
-from PIL import Image
-import io
+from flask import Flask, Request, render_template, request, redirect, url_for, jsonify, send_from_directory, send_file, Response, stream_with_context, abort
+import atexit
+import functools
+import math
 import sqlite3
 import os
-from werkzeug.utils import secure_filename
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+from werkzeug.http import is_resource_modified
+from werkzeug.security import safe_join
+from image_cache import ImageCache
+from image_store import ImageStore
+from image_utils import IMAGE_FORMATS, content_hash, image_size, image_type, render_frame, within_decode_limit
+import metrics
+from pour_writer import PourWriter
+from render_pool import RenderPool
+from tap_cache import TapCache
+from tap_events import TapNotifier
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'static/beer_images'
 app.config['DATABASE'] = 'beer_taps.db'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
+app.config['IMAGE_CACHE_FOLDER'] = 'cache/images'
+app.config['IMAGE_CACHE_MAX_BYTES'] = 64 * 1024 * 1024  # 64MB of rendered variants
+app.config['IMAGE_CACHE_TOUCH_INTERVAL'] = 60  # seconds between LRU touches of a cached variant
+app.config['IMAGE_QUALITY'] = 85
+app.config['IMMUTABLE_MAX_AGE'] = 365 * 24 * 3600  # content-addressed image URLs never change
+app.config['IMAGE_GC_MIN_AGE'] = 3600  # seconds an unreferenced upload is kept before gc-images removes it
+app.config['IMAGE_RENDER_WORKERS'] = 2  # Pillow processes per server worker
+app.config['IMAGE_RENDER_TIMEOUT'] = 30  # longest a device request waits for a render, in seconds
+app.config['IMAGE_RETRY_AFTER'] = 5  # seconds a device told the image is still rendering waits to retry
+# Variants rendered in the background as soon as an image is uploaded
+app.config['DEVICE_DISPLAY_SIZES'] = [(240, 240)]  # GC9A01 round display
+app.config['DEVICE_IMAGE_FORMATS'] = ['jpeg', 'rgb565']  # formats pre-rendered at the display sizes
+# Square thumbnails for the web pages, offered to browsers as a srcset so each
+# picks the one that suits its pixel density; WebP where the browser takes it
+app.config['WEB_THUMBNAIL_SIZES'] = [(100, 100), (200, 200), (300, 300)]
+app.config['WEB_THUMBNAIL_FORMATS'] = ['webp', 'jpeg']
+# Font for server-composited tap frames; Pillow's built-in font is used if it's missing
+app.config['FRAME_FONT'] = '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf'
+app.config['DB_BUSY_TIMEOUT_MS'] = 5000
+app.config['DB_CACHE_SIZE_KB'] = 8 * 1024  # page cache per connection
+app.config['DB_MMAP_SIZE'] = 64 * 1024 * 1024
+app.config['DB_CACHED_STATEMENTS'] = 64  # prepared statements kept per connection
+app.config['POUR_GROUP_COMMIT'] = True  # commit device pours in groups on a writer thread
+app.config['POUR_FLUSH_INTERVAL_MS'] = 20
+app.config['POUR_FLUSH_MAX_EVENTS'] = 100
+app.config['POUR_WRITE_TIMEOUT'] = 10  # longest a pour request waits on the writer thread, in seconds
+app.config['EVENTS_POLL_INTERVAL'] = 1.0  # seconds between checks for writes from other workers
+app.config['EVENTS_MAX_TIMEOUT'] = 55  # longest a device long-poll may hold a request, in seconds
+app.config['EVENTS_KEEPALIVE'] = 15  # seconds between SSE keep-alive comments
+app.config['TAP_CACHE_SYNC_INTERVAL'] = 0.5  # how stale another worker's tap writes may look, in seconds
+app.config['METRICS_DIR'] = os.environ.get('TAP_METRICS_DIR')  # where workers add up /metrics; set by gunicorn.conf.py
+app.config['METRICS_PUBLISH_INTERVAL'] = 5  # how stale another worker's metrics may look, in seconds
 
-# Ensure upload directory exists
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+# Uploaded images, stored once per distinct content as <upload folder>/ab/cd/<sha1>.<ext>
+image_store = ImageStore(app.config['UPLOAD_FOLDER'])
+
+# beers.image_path is relative to static/, image store names to the upload folder
+IMAGE_PATH_PREFIX = 'beer_images/'
+
+# Resized images served to the tap displays, keyed by source file and size
+image_cache = ImageCache(app.config['IMAGE_CACHE_FOLDER'], app.config['IMAGE_CACHE_MAX_BYTES'],
+                         app.config['IMAGE_CACHE_TOUCH_INTERVAL'])
+
+# Renders those variants on worker processes, off the request threads
+render_pool = RenderPool(image_cache, app.config['IMAGE_RENDER_WORKERS'])
+atexit.register(render_pool.close)
+
+def still_rendering():
+    """503 for a request whose render didn't finish within IMAGE_RENDER_TIMEOUT; the device retries"""
+    return jsonify({'error': 'Image is still rendering'}), 503, {'Retry-After': str(app.config['IMAGE_RETRY_AFTER'])}
+
+if app.config['METRICS_DIR']:
+    metrics.share(app.config['METRICS_DIR'], app.config['METRICS_PUBLISH_INTERVAL'])
+
+class TimedConnection(sqlite3.Connection):
+    """sqlite3 connection that records time spent in execute and commit calls"""
+
+    def execute(self, *args):
+        with metrics.SQLITE_SECONDS.time('execute'):
+            return super().execute(*args)
+
+    def executemany(self, *args):
+        with metrics.SQLITE_SECONDS.time('executemany'):
+            return super().executemany(*args)
+
+    def commit(self):
+        with metrics.SQLITE_SECONDS.time('commit'):
+            return super().commit()
+
+# Each thread keeps one connection open for its whole life instead of paying
+# for connect + pragma setup on every request
+_db_local = threading.local()
 
 def get_db_connection():
-    conn = sqlite3.connect(app.config['DATABASE'])
+    """Return this thread's long-lived database connection, opening it on first use.
+
+    Callers must not close it. Connections are never shared across a fork, so
+    each pre-forked worker process opens its own.
+    """
+    key = (os.getpid(), app.config['DATABASE'])
+    conn = getattr(_db_local, 'conn', None)
+    if conn is not None and _db_local.key == key:
+        return conn
+    if conn is not None and _db_local.key[0] == key[0]:
+        conn.close()
+
+    conn = sqlite3.connect(app.config['DATABASE'],
+                           timeout=app.config['DB_BUSY_TIMEOUT_MS'] / 1000,
+                           cached_statements=app.config['DB_CACHED_STATEMENTS'],
+                           factory=TimedConnection)
     conn.row_factory = sqlite3.Row
+    # WAL lets dashboard and device reads run while a pour is being written,
+    # and NORMAL sync is still crash-safe in WAL mode with far fewer fsyncs
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f"PRAGMA busy_timeout = {app.config['DB_BUSY_TIMEOUT_MS']}")
+    conn.execute(f"PRAGMA cache_size = -{app.config['DB_CACHE_SIZE_KB']}")
+    conn.execute(f"PRAGMA mmap_size = {app.config['DB_MMAP_SIZE']}")
+    _db_local.conn = conn
+    _db_local.key = key
     return conn
 
+@app.teardown_appcontext
+def rollback_db(exception):
+    """Don't let a request that failed mid-write leave its transaction open"""
+    conn = getattr(_db_local, 'conn', None)
+    if conn is not None and _db_local.key[0] == os.getpid() and conn.in_transaction:
+        conn.rollback()
+
+# Columns added after the first release, applied to existing databases by upgrade_db()
+SCHEMA_UPGRADES = {
+    'taps': [
+        ('version', 'INTEGER NOT NULL DEFAULT 0'),
+        ('updated_at', 'INTEGER NOT NULL DEFAULT 0'),
+    ],
+    'pours': [
+        ('event_id', 'TEXT'),
+    ],
+}
+
+# SET clause that stamps a tap row with the next fleet-wide version
+TAP_VERSION_BUMP = ("version = (SELECT COALESCE(MAX(version), 0) + 1 FROM taps), "
+                    "updated_at = CAST(strftime('%s', 'now') AS INTEGER)")
+
+# Subtracts a pour from a tap inside SQLite, so overlapping pours can't lose
+# each other's decrement. RETURNING needs SQLite 3.35; older libraries read the
+# row back inside the same write transaction instead.
+POUR_UPDATE = f'UPDATE taps SET volume = MAX(0, volume - ? * flow_rate), {TAP_VERSION_BUMP} WHERE tap_id = ?'
+HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+POUR_INSERT = 'INSERT INTO pours (tap_id, device_ts, duration, volume, source) VALUES (?, ?, ?, ?, ?)'
+
+# Batch form of POUR_INSERT that looks the flow rate up itself and skips
+# unknown taps, and pours whose event_id the tap has already reported
+POUR_INSERT_FROM_TAP = ('INSERT OR IGNORE INTO pours (tap_id, event_id, device_ts, duration, volume, source) '
+                        'SELECT tap_id, ?, ?, ?, ? * flow_rate, ? FROM taps WHERE tap_id = ?')
+
+def apply_pour(conn, tap_id, duration, source, device_ts=None):
+    """Atomically pour duration seconds from a tap and log it in the pours table.
+
+    Returns (volume_poured, new_volume), or None if the tap doesn't exist.
+    The caller is responsible for committing.
+    """
+    if HAS_RETURNING:
+        rows = conn.execute(POUR_UPDATE + ' RETURNING volume, flow_rate', (duration, tap_id)).fetchall()
+    else:
+        cursor = conn.execute(POUR_UPDATE, (duration, tap_id))
+        rows = []
+        if cursor.rowcount:
+            rows = conn.execute('SELECT volume, flow_rate FROM taps WHERE tap_id = ?', (tap_id,)).fetchall()
+    if not rows:
+        return None
+    # Calculate volume poured based on flow rate (mL/s)
+    volume_poured = duration * rows[0]['flow_rate']
+    conn.execute(POUR_INSERT, (tap_id, device_ts, duration, volume_poured, source))
+    # The REAL column can hand back whole numbers as ints, keep the API consistent
+    return volume_poured, float(rows[0]['volume'])
+
+# Single writer thread that group-commits pours from the device endpoints
+pour_writer = PourWriter(get_db_connection, apply_pour,
+                         flush_interval_ms=app.config['POUR_FLUSH_INTERVAL_MS'],
+                         max_batch=app.config['POUR_FLUSH_MAX_EVENTS'])
+atexit.register(pour_writer.close)
+
+# Wakes devices waiting on /api/tap/<tap_id>/events once a tap write commits
+tap_notifier = TapNotifier(poll_interval=app.config['EVENTS_POLL_INTERVAL'])
+
+def pour_values(duration, timestamp):
+    """Validate a device's pour duration and timestamp, returning them as (duration, device_ts).
+
+    Raises ValueError unless duration is a finite number of seconds, not
+    negative, and timestamp is missing or a finite number.
+    """
+    try:
+        duration = float(duration)
+    except (TypeError, ValueError):
+        duration = math.nan
+    if not math.isfinite(duration) or duration < 0:
+        raise ValueError('Pour duration must be a number of seconds, not negative')
+    if timestamp is None:
+        return duration, None
+    if isinstance(timestamp, bool) or not isinstance(timestamp, (int, float)) or not math.isfinite(timestamp):
+        raise ValueError('Pour timestamp must be a unix time')
+    return duration, float(timestamp)
+
+def record_pour(tap_id, duration, source, device_ts=None):
+    """Apply and commit a pour, through the group-commit queue when it's enabled"""
+    if app.config['POUR_GROUP_COMMIT']:
+        future = pour_writer.submit(tap_id, duration, source, device_ts)
+        try:
+            result = future.result(timeout=app.config['POUR_WRITE_TIMEOUT'])
+        except TimeoutError:
+            # The writer is stuck (database locked, say); free this thread
+            if future.cancel():
+                # Taken off the queue unapplied, so the device can safely send it again
+                response = jsonify({'error': 'Pour could not be recorded in time'})
+                response.status_code = 503
+                response.headers['Retry-After'] = '5'
+            else:
+                # Already being applied and will still be committed; a retry would pour it twice
+                response = jsonify({'success': True, 'pending': True})
+                response.status_code = 202
+            abort(response)
+    else:
+        conn = get_db_connection()
+        result = apply_pour(conn, tap_id, duration, source, device_ts)
+        conn.commit()
+    taps_changed(get_db_connection())
+    return result
+
+# Hot device query, kept as a constant so every request reuses the same
+# prepared statement from the connection's statement cache
+TAPS_SINCE_QUERY = ('SELECT taps.*, beers.name, beers.abv, beers.image_path FROM taps '
+                    'LEFT JOIN beers ON taps.beer_id = beers.id '
+                    'WHERE taps.version > ? ORDER BY taps.version')
+
+# Joined tap + beer rows and their serialized responses for the device read path
+tap_cache = TapCache(TAPS_SINCE_QUERY, sync_interval=app.config['TAP_CACHE_SYNC_INTERVAL'])
+
+def taps_changed(conn):
+    """Call after committing a tap write: write the change through to the tap cache and wake waiting devices"""
+    tap_cache.sync(conn, force=True)
+    tap_notifier.notify()
+
 def init_db():
     with app.app_context():
         conn = get_db_connection()
         with open('schema.sql') as f:
             conn.executescript(f.read())
+        with open('seed.sql') as f:
+            conn.executescript(f.read())
         conn.commit()
-        conn.close()
+
+def upgrade_db():
+    """Bring an existing database up to the current schema"""
+    with app.app_context():
+        conn = get_db_connection()
+        for table, columns in SCHEMA_UPGRADES.items():
+            existing = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+            if not existing:
+                continue  # a new table, created whole from schema.sql below
+            for name, definition in columns:
+                if name not in existing:
+                    conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+        with open('schema.sql') as f:
+            conn.executescript(f.read())
+        conn.commit()
+
+def migrate_image_paths():
+    """Move beer images saved under their upload filename into the content-addressed store.
+
+    The original files are left where they are; default.jpg is still the
+    fallback for beers without an image.
+    """
+    with app.app_context():
+        conn = get_db_connection()
+        for beer in conn.execute('SELECT id, image_path FROM beers WHERE image_path IS NOT NULL').fetchall():
+            if image_store.is_blob(beer['image_path'].removeprefix(IMAGE_PATH_PREFIX)):
+                continue
+            path = tap_image_file(beer['image_path'])
+            if not os.path.isfile(path):
+                continue
+            with open(path, 'rb') as f:
+                image_path = IMAGE_PATH_PREFIX + image_store.save(f, os.path.splitext(path)[1] or '.jpg')
+            conn.execute('UPDATE beers SET image_path = ? WHERE id = ?', (image_path, beer['id']))
+            conn.execute(f'UPDATE taps SET {TAP_VERSION_BUMP} WHERE beer_id = ?', (beer['id'],))
+        conn.commit()
+
+def prepare_db():
+    """Create the database on first run, otherwise upgrade it in place"""
+    if not os.path.exists(app.config['DATABASE']):
+        init_db()
+    else:
+        upgrade_db()
+    migrate_image_paths()
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create or upgrade the database before the server workers start"""
+    prepare_db()
+    print(f"Database ready: {app.config['DATABASE']}")
+
+@app.cli.command('gc-images')
+def gc_images_command():
+    """Delete uploaded images that no beer refers to any more"""
+    conn = get_db_connection()
+    referenced = {row['image_path'].removeprefix(IMAGE_PATH_PREFIX)
+                  for row in conn.execute('SELECT image_path FROM beers WHERE image_path IS NOT NULL')}
+    removed = image_store.gc(referenced, app.config['IMAGE_GC_MIN_AGE'])
+    for name in removed:
+        image_cache.invalidate(tap_image_file(IMAGE_PATH_PREFIX + name))
+        conn.execute('DELETE FROM image_jobs WHERE image_path = ?', (IMAGE_PATH_PREFIX + name,))
+    conn.commit()
+    print(f"Removed {len(removed)} unreferenced images")
+
+def not_modified(etag, last_modified=None):
+    """Return a 304 response if the request's validators still match, else None"""
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    return response
+
+@app.before_request
+def start_request_metrics():
+    request.environ['tap.metrics_start'] = time.perf_counter()
+    metrics.IN_FLIGHT.inc(1)
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or 'unmatched'
+    elapsed = time.perf_counter() - request.environ['tap.metrics_start']
+    metrics.REQUESTS.inc(1, endpoint, request.method, response.status_code)
+    metrics.REQUEST_SECONDS.observe(elapsed, endpoint)
+    if response.content_length:
+        metrics.RESPONSE_BYTES.inc(response.content_length, endpoint)
+    request.environ['tap.metrics_recorded'] = True
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exception):
+    if 'tap.metrics_start' not in request.environ:
+        return
+    metrics.IN_FLIGHT.inc(-1)
+    if not request.environ.get('tap.metrics_recorded'):
+        # Unhandled exception, after_request never ran
+        metrics.REQUESTS.inc(1, request.endpoint or 'unmatched', request.method, 500)
+
+@metrics.collector
+def collect_tap_cache_metrics():
+    metrics.TAP_CACHE.set(tap_cache.hits, 'hit')
+    metrics.TAP_CACHE.set(tap_cache.misses, 'miss')
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus scrape endpoint, summed over the gunicorn workers when METRICS_DIR is set"""
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def index():
@@ -33,16 +370,67 @@ def index():
     beers = conn.execute('SELECT * FROM beers').fetchall()
     taps = conn.execute('SELECT taps.id, taps.tap_id, taps.beer_id, taps.volume, taps.full_volume, taps.flow_rate, beers.name AS beer_name '
                       'FROM taps LEFT JOIN beers ON taps.beer_id = beers.id').fetchall()
-    conn.close()
     return render_template('index.html', beers=beers, taps=taps)
 
 @app.route('/beers')
 def beers():
     conn = get_db_connection()
     beers = conn.execute('SELECT * FROM beers').fetchall()
-    conn.close()
     return render_template('beers.html', beers=beers)
 
+UPLOAD_TYPE_ERROR = 'Upload a JPEG, PNG, GIF or WebP image'
+
+class UploadRequest(Request):
+    """Request that streams uploaded files into the image store as they arrive.
+
+    Werkzeug would spool each file to a temp file of its own first. Writing
+    it to a StagedFile instead hashes it on the way in, refuses a non-image
+    from its first bytes and leaves it ready to be renamed into place.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.staged_files = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        staged = image_store.stage(on_head=check_upload_head)
+        self.staged_files.append(staged)
+        return staged
+
+    def close(self):
+        super().close()
+        # Includes files refused part-way through, which never reach request.files
+        for staged in self.staged_files:
+            staged.close()
+
+app.request_class = UploadRequest
+
+def check_upload_head(head):
+    """Refuse an upload that isn't an image while the rest of it is still arriving"""
+    if image_type(head) is None:
+        abort(415, UPLOAD_TYPE_ERROR)
+
+def save_upload(file):
+    """Store an uploaded image by its content and return the beers.image_path for it.
+
+    The file is stored under the extension of the format it actually is,
+    whatever it was called, and only once its header shows it can be
+    resized for the displays.
+    """
+    staged = file.stream
+    staged.flush()
+    # Files shorter than StagedFile.HEAD_SIZE never reached check_upload_head
+    ext = image_type(staged.head)
+    if ext is None:
+        abort(415, UPLOAD_TYPE_ERROR)
+    try:
+        fits = within_decode_limit(staged.path)
+    except OSError:
+        abort(415, 'The image file is damaged')
+    if not fits:
+        abort(413, 'The image has too many pixels to display')
+    return IMAGE_PATH_PREFIX + image_store.commit(staged, ext)
+
 @app.route('/add_beer', methods=('GET', 'POST'))
 def add_beer():
     if request.method == 'POST':
@@ -54,16 +442,14 @@ def add_beer():
         if 'image' in request.files:
             file = request.files['image']
             if file.filename != '':
-                filename = secure_filename(file.filename)
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(file_path)
-                image_path = f'beer_images/{filename}'
+                image_path = save_upload(file)
 
         conn = get_db_connection()
         conn.execute('INSERT INTO beers (name, abv, image_path) VALUES (?, ?, ?)',
                     (name, abv, image_path))
         conn.commit()
-        conn.close()
+        if image_path:
+            prerender_image(image_path)
         return redirect(url_for('beers'))
 
     return render_template('add_beer.html')
@@ -74,9 +460,11 @@ def taps():
     taps = conn.execute('SELECT taps.id, taps.tap_id, taps.beer_id, taps.volume, taps.full_volume, taps.flow_rate, beers.name AS beer_name, beers.image_path as beer_image '
                       'FROM taps LEFT JOIN beers ON taps.beer_id = beers.id').fetchall()
     beers = conn.execute('SELECT * FROM beers').fetchall()
-    conn.close()
     return render_template('taps.html', taps=taps, beers=beers)
 
+# Shown on the tap forms when the unique index on taps.tap_id refuses a write
+TAP_ID_IN_USE = 'Tap ID {} is already in use by another tap'
+
 @app.route('/add_tap', methods=('GET', 'POST'))
 def add_tap():
     if request.method == 'POST':
@@ -88,15 +476,21 @@ def add_tap():
         flow_rate = float(request.form['flow_rate'])
 
         conn = get_db_connection()
-        conn.execute('INSERT INTO taps (tap_id, beer_id, volume, full_volume, flow_rate) VALUES (?, ?, ?, ?)',
-                    (tap_id, beer_id, volume, full_volume, flow_rate))
+        try:
+            conn.execute('INSERT INTO taps (tap_id, beer_id, volume, full_volume, flow_rate, version, updated_at) '
+                         'VALUES (?, ?, ?, ?, ?, (SELECT COALESCE(MAX(version), 0) + 1 FROM taps), '
+                         "CAST(strftime('%s', 'now') AS INTEGER))",
+                        (tap_id, beer_id, volume, full_volume, flow_rate))
+        except sqlite3.IntegrityError:
+            conn.rollback()
+            beers = conn.execute('SELECT * FROM beers').fetchall()
+            return render_template('add_tap.html', beers=beers, error=TAP_ID_IN_USE.format(tap_id)), 409
         conn.commit()
-        conn.close()
+        taps_changed(conn)
         return redirect(url_for('taps'))
 
     conn = get_db_connection()
     beers = conn.execute('SELECT * FROM beers').fetchall()
-    conn.close()
     return render_template('add_tap.html', beers=beers)
 
 @app.route('/edit_tap/<int:id>', methods=('GET', 'POST'))
@@ -105,7 +499,6 @@ def edit_tap(id):
     tap = conn.execute('SELECT * FROM taps WHERE id = ?', (id,)).fetchone()
 
     if not tap:
-        conn.close()
         return redirect(url_for('taps'))
 
     if request.method == 'POST':
@@ -115,14 +508,22 @@ def edit_tap(id):
         full_volume = float(request.form['full_volume'])
         flow_rate = float(request.form['flow_rate'])
 
-        conn.execute('UPDATE taps SET tap_id = ?, beer_id = ?, volume = ?, full_volume = ?, flow_rate = ? WHERE id = ?',
-                   (tap_id, beer_id, volume, full_volume, flow_rate, id))
+        try:
+            conn.execute(f'UPDATE taps SET tap_id = ?, beer_id = ?, volume = ?, full_volume = ?, flow_rate = ?, {TAP_VERSION_BUMP} '
+                         'WHERE id = ?',
+                       (tap_id, beer_id, volume, full_volume, flow_rate, id))
+        except sqlite3.IntegrityError:
+            conn.rollback()
+            # Show the form as it was submitted, not as it's stored
+            edited = dict(tap, tap_id=tap_id, beer_id=int(beer_id) if beer_id else None,
+                          volume=volume, full_volume=full_volume, flow_rate=flow_rate)
+            beers = conn.execute('SELECT * FROM beers').fetchall()
+            return render_template('edit_tap.html', tap=edited, beers=beers, error=TAP_ID_IN_USE.format(tap_id)), 409
         conn.commit()
-        conn.close()
+        taps_changed(conn)
         return redirect(url_for('taps'))
 
     beers = conn.execute('SELECT * FROM beers').fetchall()
-    conn.close()
     return render_template('edit_tap.html', tap=tap, beers=beers)
 
 @app.route('/edit_beer/<int:id>', methods=('GET', 'POST'))
@@ -131,7 +532,6 @@ def edit_beer(id):
     beer = conn.execute('SELECT * FROM beers WHERE id = ?', (id,)).fetchone()
 
     if not beer:
-        conn.close()
         return redirect(url_for('beers'))
 
     if request.method == 'POST':
@@ -140,90 +540,462 @@ def edit_beer(id):
 
         # Handle image upload
         image_path = beer['image_path']  # Keep existing image by default
+        uploaded = False
         if 'image' in request.files:
             file = request.files['image']
             if file.filename != '':
-                filename = secure_filename(file.filename)
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(file_path)
-                image_path = f'beer_images/{filename}'
+                image_path = save_upload(file)
+                uploaded = True
 
         conn.execute('UPDATE beers SET name = ?, abv = ?, image_path = ? WHERE id = ?',
                      (name, abv, image_path, id))
+        # Taps pouring this beer now report different info, so they change version too
+        conn.execute(f'UPDATE taps SET {TAP_VERSION_BUMP} WHERE beer_id = ?', (id,))
         conn.commit()
-        conn.close()
+        taps_changed(conn)
+        if uploaded:
+            prerender_image(image_path)
         return redirect(url_for('beers'))
 
-    conn.close()
-    return render_template('edit_beer.html', beer=beer)
+    image_job = conn.execute('SELECT * FROM image_jobs WHERE image_path = ?', (beer['image_path'],)).fetchone()
+    return render_template('edit_beer.html', beer=beer, image_job=image_job)
 
 # API Endpoints for ESP32 Communication
+def tap_image_file(image_path):
+    """Filesystem path of a beer image, falling back to the default image"""
+    default = os.path.join(app.config['UPLOAD_FOLDER'], 'default.jpg')
+    if not image_path:
+        return default
+    # Content-addressed images sit in shard directories, so keep the whole relative path
+    return safe_join(app.config['UPLOAD_FOLDER'], image_path.removeprefix(IMAGE_PATH_PREFIX)) or default
+
+def resized_image_file(source_path, width, height, fmt='jpeg'):
+    """Path of source_path rendered at width x height in fmt, waiting on the render pool on a cache miss"""
+    future = render_pool.render(source_path, width, height, app.config['IMAGE_QUALITY'], fmt)
+    return future.result(timeout=app.config['IMAGE_RENDER_TIMEOUT'])
+
+IMAGE_JOB_START = ('INSERT OR REPLACE INTO image_jobs (image_path, status, variants) '
+                   "VALUES (?, 'rendering', ?)")
+IMAGE_JOB_FAILED = ("UPDATE image_jobs SET status = 'failed', error = ?, "
+                    "updated_at = CAST(strftime('%s', 'now') AS INTEGER) WHERE id = ?")
+IMAGE_JOB_RENDERED = ("UPDATE image_jobs SET rendered = rendered + 1, "
+                      "status = CASE WHEN status = 'rendering' AND rendered + 1 >= variants THEN 'done' ELSE status END, "
+                      "updated_at = CAST(strftime('%s', 'now') AS INTEGER) WHERE id = ?")
+
+def prerender_image(image_path):
+    """Queue every display and thumbnail variant of a newly uploaded beer image.
+
+    Returns straight away; image_jobs tracks the renders as they finish, so
+    device and web requests find the variants already cached.
+    """
+    variants = [(width, height, fmt) for width, height in app.config['DEVICE_DISPLAY_SIZES']
+                for fmt in app.config['DEVICE_IMAGE_FORMATS']]
+    variants += [(width, height, fmt) for width, height in app.config['WEB_THUMBNAIL_SIZES']
+                 for fmt in app.config['WEB_THUMBNAIL_FORMATS']]
+    conn = get_db_connection()
+    job_id = conn.execute(IMAGE_JOB_START, (image_path, len(variants))).lastrowid
+    conn.commit()
+    source_path = tap_image_file(image_path)
+    for width, height, fmt in variants:
+        future = render_pool.render(source_path, width, height, app.config['IMAGE_QUALITY'], fmt)
+        future.add_done_callback(functools.partial(image_job_progress, job_id))
+
+def image_job_progress(job_id, future):
+    """Record one finished variant against its image job"""
+    # Runs on the render pool's callback thread, which keeps its own connection
+    conn = get_db_connection()
+    error = future.exception()
+    if error is not None:
+        conn.execute(IMAGE_JOB_FAILED, (str(error) or type(error).__name__, job_id))
+    else:
+        conn.execute(IMAGE_JOB_RENDERED, (job_id,))
+    conn.commit()
+
+# Query arguments that select each image format on get_tap_image
+IMAGE_FORMAT_ARGS = {
+    'jpeg': {},
+    'webp': {'format': 'webp'},
+    'rgb565': {'format': 'rgb565'},
+    'rgb565-zlib': {'format': 'rgb565', 'compress': 'zlib'},
+}
+
+def display_variant(view=None):
+    """The ?width=, ?height=, ?format=, ?compress= and ?view= a device asked for.
+
+    Raw formats and composited frames are always rendered at a fixed size,
+    so they default to the first registered display size. Endpoints that
+    only serve one view pass it in.
+    """
+    width = request.args.get('width', type=int)
+    height = request.args.get('height', type=int)
+    fmt = request.args.get('format', 'jpeg')
+    if fmt == 'rgb565' and request.args.get('compress') == 'zlib':
+        fmt = 'rgb565-zlib'
+    view = view or request.args.get('view', 'image')
+    if (fmt != 'jpeg' or view == 'frame') and not (width and height):
+        width, height = app.config['DEVICE_DISPLAY_SIZES'][0]
+    return width, height, fmt, view
+
+def variant_error(width, height, fmt, view):
+    """Error response for an unsupported size, ?format= or ?view=, or None if all are fine.
+
+    Only the registered display and thumbnail sizes are rendered: every
+    other size would be a fresh render and a cache entry of its own.
+    """
+    sizes = app.config['DEVICE_DISPLAY_SIZES'] + app.config['WEB_THUMBNAIL_SIZES']
+    if (width or height) and (width, height) not in sizes:
+        return jsonify({'error': f'Unsupported image size: {width}x{height}'}), 400
+    if fmt not in IMAGE_FORMATS:
+        return jsonify({'error': f'Unknown image format: {fmt}'}), 400
+    if view not in ('image', 'frame'):
+        return jsonify({'error': f'Unknown view: {view}'}), 400
+    return None
+
+def keg_level(tap):
+    """Whole percent of the keg left, as drawn on the frame's ring"""
+    if not tap['full_volume']:
+        return 0
+    return max(0, min(100, round(100 * tap['volume'] / tap['full_volume'])))
+
+def frame_file(tap, width, height, fmt='jpeg'):
+    """Path of a tap's full-screen frame: its image with the name, ABV and keg level drawn on"""
+    source_path = tap_image_file(tap['image_path'])
+    base_path = resized_image_file(source_path, width, height)
+    name = tap['name'] or 'No beer'
+    abv = f"{tap['abv']}% ABV" if tap['abv'] else ''
+    level = keg_level(tap)
+    quality = app.config['IMAGE_QUALITY']
+    font = app.config['FRAME_FONT']
+    # Keyed on what the frame shows rather than the tap version, so a pour
+    # that doesn't move the ring by a whole percent reuses the cached frame.
+    # The source image, not base_path: a cache entry's mtime moves as it's used.
+    key = image_cache.key_for(source_path, 'frame', width, height, name, abv, level, quality, font,
+                              ext=IMAGE_FORMATS[fmt][0])
+    future = render_pool.run(key, render_frame, fmt, base_path, name, abv, level, quality, font)
+    return future.result(timeout=app.config['IMAGE_RENDER_TIMEOUT'])
+
+@app.template_global()
+def image_url(image_path, width=None, height=None, fmt='jpeg'):
+    """URL of an uploaded beer image, or of a variant of it rendered at width x height in fmt"""
+    return url_for('image_blob', name=image_path.removeprefix(IMAGE_PATH_PREFIX),
+                   width=width, height=height, **IMAGE_FORMAT_ARGS[fmt])
+
+@app.template_global()
+def image_srcset(image_path, fmt='jpeg'):
+    """srcset of a beer image's web thumbnails in fmt, for the browser to choose from"""
+    # One url_for per image rather than per size: list pages call this for every beer
+    base = image_url(image_path)
+    return ', '.join(f"{base}?{urlencode(dict(width=width, height=height, **IMAGE_FORMAT_ARGS[fmt]))} {width}w"
+                     for width, height in app.config['WEB_THUMBNAIL_SIZES'])
+
+def image_manifest(tap, width=None, height=None, fmt='jpeg', view='image'):
+    """Describe the image a device would download for a tap at the given display size and format.
+
+    With view='frame' it describes the composited full-screen frame instead.
+
+    The hash is the SHA-1 of the exact bytes get_tap_image serves, so a device
+    only downloads when it differs from the copy it already has.
+    """
+    source_path = tap_image_file(tap['image_path'])
+    try:
+        if view == 'frame':
+            path = frame_file(tap, width, height, fmt)
+            url = url_for('get_tap_frame', tap_id=tap['tap_id'], width=width, height=height,
+                          **IMAGE_FORMAT_ARGS[fmt])
+        elif width and height:
+            path = resized_image_file(source_path, width, height, fmt)
+            # Uploaded images have their own URLs, which can be cached forever
+            if tap['image_path']:
+                url = image_url(tap['image_path'], width, height, fmt)
+            else:
+                url = url_for('get_tap_image', tap_id=tap['tap_id'], width=width, height=height,
+                              **IMAGE_FORMAT_ARGS[fmt])
+        else:
+            path = source_path
+            width, height = image_size(source_path)
+            if tap['image_path']:
+                url = image_url(tap['image_path'])
+            else:
+                url = url_for('get_tap_image', tap_id=tap['tap_id'])
+        return {
+            'hash': content_hash(path),
+            'size': os.path.getsize(path),
+            'width': width,
+            'height': height,
+            'format': fmt,
+            'url': url
+        }
+    except TimeoutError:
+        # Still rendering (an OSError too, from Python 3.11): let the caller answer 503
+        raise
+    except OSError:
+        # Missing or unreadable image file, the device keeps whatever it has
+        return None
+
+# Device API field names and the joined tap + beer columns they come from
+TAP_FIELDS = {
+    'tap_id': 'tap_id',
+    'beer_name': 'name',
+    'beer_abv': 'abv',
+    'volume': 'volume',
+    'full_volume': 'full_volume',
+    'flow_rate': 'flow_rate',
+    'image_path': 'image_path',
+    'version': 'version'
+}
+
+def tap_payload(tap, width=None, height=None, fmt='jpeg', view='image'):
+    """Build the device API's view of a tap from a tap cache row"""
+    payload = {field: tap[column] for field, column in TAP_FIELDS.items()}
+    payload['image'] = image_manifest(tap, width, height, fmt, view)
+    return payload
+
+def tap_validators(tap, width=None, height=None, fmt='jpeg', view='image'):
+    """ETag and Last-Modified for a tap payload"""
+    # The tap version changes on every write that affects this payload
+    etag = f"tap-{tap['version']}-{tap['updated_at']}"
+    if width and height:
+        etag += f'-{width}x{height}'
+    if fmt != 'jpeg':
+        etag += f'-{fmt}'
+    if view != 'image':
+        etag += f'-{view}'
+    return etag, datetime.fromtimestamp(tap['updated_at'], timezone.utc)
+
+def tap_json(tap, width=None, height=None, fmt='jpeg', view='image'):
+    """Serialized tap payload, built once per tap version, display size, image format and view.
+
+    Returns (body, complete). A payload whose image manifest fell back to
+    null is not complete and is built again on the next request. Raises
+    TimeoutError if the image is still being rendered.
+    """
+    def build():
+        payload = tap_payload(tap, width, height, fmt, view)
+        return app.json.dumps(payload).encode(), payload['image'] is not None
+    return tap_cache.rendered(tap, (width, height, fmt, view), build)
+
+def tap_info_response(tap, width=None, height=None, fmt='jpeg', view='image'):
+    """JSON response for a tap row, with validators for conditional GETs"""
+    try:
+        body, complete = tap_json(tap, width, height, fmt, view)
+    except TimeoutError:
+        return still_rendering()
+    response = app.response_class(body, mimetype='application/json')
+    if complete:
+        # Without validators a device can't turn a payload missing its image into 304s
+        etag, last_modified = tap_validators(tap, width, height, fmt, view)
+        response.set_etag(etag)
+        response.last_modified = last_modified
+    return response
+
 @app.route('/api/tap/<tap_id>', methods=['GET'])
 def get_tap_info(tap_id):
-    conn = get_db_connection()
-    tap = conn.execute('SELECT taps.*, beers.name, beers.abv, beers.image_path FROM taps '
-                     'LEFT JOIN beers ON taps.beer_id = beers.id '
-                     'WHERE tap_id = ?', (tap_id,)).fetchone()
-    conn.close()
+    """Tap info, with a manifest of the image resized to ?width= x ?height= in ?format= if given.
+
+    ?view=frame describes the server-composited frame from /frame instead.
+    """
+    width, height, fmt, view = display_variant()
+    error = variant_error(width, height, fmt, view)
+    if error:
+        return error
+
+    tap = tap_cache.get(get_db_connection(), tap_id)
 
     if not tap:
         return jsonify({'error': 'Tap not found'}), 404
 
-    return jsonify({
-        'tap_id': tap['tap_id'],
-        'beer_name': tap['name'],
-        'beer_abv': tap['abv'],
-        'volume': tap['volume'],
-        'full_volume': tap['full_volume'],
-        'flow_rate': tap['flow_rate'],
-        'image_path': tap['image_path']
-    })
+    cached = not_modified(*tap_validators(tap, width, height, fmt, view))
+    if cached:
+        return cached
+
+    return tap_info_response(tap, width, height, fmt, view)
+
+@app.route('/api/taps', methods=['GET'])
+def get_taps():
+    """Every tap joined with its beer, for dashboards and monitoring scripts.
+
+    ?fields=tap_id,volume limits each tap to those fields (tap_id is always
+    included). ?since=<version> returns only taps changed after that
+    version; pass the response's version back in to poll for deltas.
+    """
+    since = request.args.get('since', -1, type=int)
+    fields = request.args.get('fields')
+    fields = fields.split(',') if fields else list(TAP_FIELDS)
+    unknown = [field for field in fields if field not in TAP_FIELDS]
+    if unknown:
+        return jsonify({'error': f"Unknown fields: {', '.join(unknown)}"}), 400
+    if 'tap_id' not in fields:
+        fields.insert(0, 'tap_id')
+
+    conn = get_db_connection()
+    # Every tap write raises the max version, so it validates any view of the fleet
+    version = conn.execute('SELECT COALESCE(MAX(version), 0) FROM taps').fetchone()[0]
+    cached = not_modified(f"taps-{version}-{since}-{','.join(fields)}")
+    if cached:
+        return cached
+
+    columns = [(field, TAP_FIELDS[field]) for field in fields]
+    taps = [{field: tap[column] for field, column in columns}
+            for tap in conn.execute(TAPS_SINCE_QUERY, (since,))]
+
+    response = jsonify({'version': version, 'taps': taps})
+    response.set_etag(f"taps-{version}-{since}-{','.join(fields)}")
+    return response
+
+@app.route('/api/tap/<tap_id>/events', methods=['GET'])
+def tap_events(tap_id):
+    """Push tap changes to a device as soon as they're committed.
+
+    Clients that accept text/event-stream get a server-sent event stream
+    with one 'tap' event per change. Everyone else gets a long-poll: the
+    request is held until the tap's version passes ?since=, then answered
+    like /api/tap/<tap_id>, or with 204 after ?timeout= seconds.
+    """
+    width, height, fmt, view = display_variant()
+    error = variant_error(width, height, fmt, view)
+    if error:
+        return error
+    since = request.args.get('since', type=int)
+    if since is None:
+        since = request.headers.get('Last-Event-ID', -1, type=int)
+
+    def changed_since(version):
+        tap = tap_cache.get(get_db_connection(), tap_id)
+        if tap is None or tap['version'] > version:
+            # A missing tap also ends the wait, so the caller can report it
+            return tap or 'missing'
+        return None
+
+    if tap_cache.get(get_db_connection(), tap_id) is None:
+        return jsonify({'error': 'Tap not found'}), 404
+
+    if request.accept_mimetypes.best == 'text/event-stream':
+        keepalive = app.config['EVENTS_KEEPALIVE']
+
+        def stream():
+            version = since
+            while True:
+                tap = tap_notifier.wait_for(lambda: changed_since(version), keepalive)
+                if tap is None:
+                    yield ': keepalive\n\n'
+                    continue
+                if tap == 'missing':
+                    return
+                try:
+                    payload = tap_json(tap, width, height, fmt, view)[0].decode()
+                except TimeoutError:
+                    # Still rendering; the tap still counts as changed, so the next pass retries
+                    continue
+                version = tap['version']
+                yield f'id: {version}\nevent: tap\ndata: {payload}\n\n'
+
+        return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    timeout = request.args.get('timeout', 30, type=float)
+    if not math.isfinite(timeout):
+        return jsonify({'error': 'timeout must be a number of seconds'}), 400
+    timeout = max(0, min(timeout, app.config['EVENTS_MAX_TIMEOUT']))
+    tap = tap_notifier.wait_for(lambda: changed_since(since), timeout)
+    if tap is None:
+        return '', 204
+    if tap == 'missing':
+        return jsonify({'error': 'Tap not found'}), 404
+    return tap_info_response(tap, width, height, fmt, view)
 
 @app.route('/api/tap/<tap_id>/image', methods=['GET'])
 def get_tap_image(tap_id):
-    width = request.args.get('width', type=int)
-    height = request.args.get('height', type=int)
+    """A tap's beer image, resized to ?width= x ?height= if given.
 
-    conn = get_db_connection()
-    tap = conn.execute('SELECT beers.image_path FROM taps '
-                       'LEFT JOIN beers ON taps.beer_id = beers.id '
-                       'WHERE tap_id = ?', (tap_id,)).fetchone()
-    conn.close()
+    ?format=rgb565 returns display-ready big-endian RGB565 pixels instead of
+    a JPEG, zlib-compressed with &compress=zlib.
+    """
+    width, height, fmt, view = display_variant('image')
+    error = variant_error(width, height, fmt, view)
+    if error:
+        return error
 
-    if not tap or not tap['image_path']:
-        image_path = os.path.join('static/beer_images', 'default.jpg')
-    else:
-        image_filename = os.path.basename(tap['image_path'])
-        image_path = os.path.join('static/beer_images', image_filename)
+    tap = tap_cache.get(get_db_connection(), tap_id)
+    image_path = tap_image_file(tap['image_path'] if tap else None)
+
+    # Validators come from the source image content, so they can be checked
+    # before any resizing work is done
+    quality = app.config['IMAGE_QUALITY']
+    etag = content_hash(image_path)
+    if width and height:
+        etag = f'{etag}-{width}x{height}-' + {'jpeg': f'q{quality}', 'webp': f'webp-q{quality}'}.get(fmt, fmt)
+    last_modified = datetime.fromtimestamp(int(os.path.getmtime(image_path)), timezone.utc)
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
 
     if not width or not height:
-        return send_file(image_path, mimetype='image/jpeg')
-
-    # Open and resize the image using Pillow
-    with Image.open(image_path) as img:
-        # Convert mode before resizing/cropping
-        if img.mode in ("RGBA", "P"):
-            img = img.convert("RGB")
-
-        # Calculate scale and crop to fill
-        src_ratio = img.width / img.height
-        target_ratio = width / height
-
-        if target_ratio > src_ratio:
-            scale_height = int(width / src_ratio)
-            img = img.resize((width, scale_height), Image.LANCZOS)
-            top = (scale_height - height) // 2
-            img = img.crop((0, top, width, top + height))
-        else:
-            scale_width = int(height * src_ratio)
-            img = img.resize((scale_width, height), Image.LANCZOS)
-            left = (scale_width - width) // 2
-            img = img.crop((left, 0, left + width, height))
+        return send_file(image_path, mimetype='image/jpeg', etag=etag, last_modified=last_modified)
+
+    # Serve the rendered variant from the disk cache, resizing only on a miss
+    try:
+        cached_path = resized_image_file(image_path, width, height, fmt)
+    except TimeoutError:
+        # The render pool is backed up; have the device retry instead of holding a thread
+        return still_rendering()
+    return send_file(cached_path, mimetype=IMAGE_FORMATS[fmt][1], etag=etag, last_modified=last_modified)
+
+@app.route('/images/<path:name>')
+def image_blob(name):
+    """An uploaded beer image, or with ?width=&height= (and ?format=) a rendered variant of it.
+
+    Content-addressed images never change under their URL, so they and
+    their variants are served as immutable for a year.
+    """
+    width, height, fmt, view = display_variant('image')
+    error = variant_error(width, height, fmt, view)
+    if error:
+        return error
+
+    # Only stored images: not uploads still being written, or anything else in the folder
+    if not (image_store.is_blob(name) or image_store.is_legacy(name)):
+        abort(404)
+    source_path = safe_join(app.config['UPLOAD_FOLDER'], name)
+    if source_path is None or not os.path.isfile(source_path):
+        abort(404)
+
+    path, mimetype = source_path, None
+    if width and height:
+        try:
+            path = resized_image_file(source_path, width, height, fmt)
+        except TimeoutError:
+            return still_rendering()
+        mimetype = IMAGE_FORMATS[fmt][1]
 
-        img_io = io.BytesIO()
-        img.save(img_io, format='JPEG', quality=85)
-        img_io.seek(0)
-        return send_file(img_io, mimetype='image/jpeg')
+    if not image_store.is_blob(name):
+        # Uploaded before content addressing, the file behind this name can change
+        return send_file(path, mimetype=mimetype)
+    response = send_file(path, mimetype=mimetype, max_age=app.config['IMMUTABLE_MAX_AGE'])
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/api/tap/<tap_id>/frame', methods=['GET'])
+def get_tap_frame(tap_id):
+    """The tap's whole screen, composited on the server: image, name, ABV and keg-level ring.
+
+    Takes the same ?width=, ?height=, ?format= and ?compress= as /image.
+    """
+    width, height, fmt, view = display_variant('frame')
+    error = variant_error(width, height, fmt, view)
+    if error:
+        return error
+
+    tap = tap_cache.get(get_db_connection(), tap_id)
+    if not tap:
+        return jsonify({'error': 'Tap not found'}), 404
+
+    try:
+        path = frame_file(tap, width, height, fmt)
+    except TimeoutError:
+        return still_rendering()
+    # The cache key covers everything drawn on the frame, so it doubles as the ETag
+    return send_file(path, mimetype=IMAGE_FORMATS[fmt][1], etag=os.path.basename(path))
 
 @app.route('/api/tap/<tap_id>/update_volume', methods=['POST'])
 def update_volume(tap_id):
@@ -231,23 +1003,17 @@ def update_volume(tap_id):
     if not data or 'pour_time' not in data:
         return jsonify({'error': 'Missing pour_time parameter'}), 400
 
-    pour_time = float(data['pour_time'])  # seconds
+    try:
+        pour_time, device_ts = pour_values(data['pour_time'], data.get('timestamp'))  # seconds
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    conn = get_db_connection()
-    tap = conn.execute('SELECT * FROM taps WHERE tap_id = ?', (tap_id,)).fetchone()
+    result = record_pour(tap_id, pour_time, 'update_volume', device_ts)
 
-    if not tap:
-        conn.close()
+    if not result:
         return jsonify({'error': 'Tap not found'}), 404
 
-    # Calculate volume poured based on flow rate (mL/s)
-    volume_poured = pour_time * tap['flow_rate']
-    new_volume = max(0, tap['volume'] - volume_poured)
-
-    conn.execute('UPDATE taps SET volume = ? WHERE tap_id = ?', (new_volume, tap_id))
-    conn.commit()
-    conn.close()
-
+    volume_poured, new_volume = result
     return jsonify({'success': True, 'new_volume': new_volume})
 
 @app.route('/api/tap/<tap_id>/pour_event', methods=['POST'])
@@ -266,29 +1032,78 @@ def pour_event(tap_id):
         if 'duration' not in data:
             return jsonify({'error': 'Missing duration parameter for stop event'}), 400
 
-        duration = float(data['duration'])  # seconds
+        try:
+            duration, device_ts = pour_values(data['duration'], data.get('timestamp'))  # seconds
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-        conn = get_db_connection()
-        tap = conn.execute('SELECT * FROM taps WHERE tap_id = ?', (tap_id,)).fetchone()
+        result = record_pour(tap_id, duration, 'pour_event', device_ts)
 
-        if not tap:
-            conn.close()
+        if not result:
             return jsonify({'error': 'Tap not found'}), 404
 
-        # Calculate volume poured based on flow rate (mL/s)
-        volume_poured = duration * tap['flow_rate']
-        new_volume = max(0, tap['volume'] - volume_poured)
-
-        conn.execute('UPDATE taps SET volume = ? WHERE tap_id = ?', (new_volume, tap_id))
-        conn.commit()
-        conn.close()
-
+        volume_poured, new_volume = result
         return jsonify({'success': True, 'volume_poured': volume_poured, 'new_volume': new_volume})
 
     return jsonify({'error': 'Invalid event_type'}), 400
 
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """In-process cache counters, for monitoring"""
+    return jsonify({'tap_cache': tap_cache.stats()})
+
+@app.route('/api/pours/batch', methods=['POST'])
+def pour_batch():
+    """Apply many pours, from one or more taps, in a single transaction.
+
+    Accepts a JSON list of {"tap_id", "duration", "timestamp", "event_id"}
+    objects, or an object with that list under "pours". Pours for unknown taps
+    are skipped and reported back in unknown_taps. event_id is optional; a
+    pour whose event_id its tap already reported is counted in duplicates and
+    not applied again, so a device can safely resend a batch it never saw
+    acknowledged.
+    """
+    data = request.json
+    events = data.get('pours') if isinstance(data, dict) else data
+    if not isinstance(events, list):
+        return jsonify({'error': 'Expected a list of pours'}), 400
+
+    try:
+        pours = [(str(event['tap_id']), *pour_values(event['duration'], event.get('timestamp')),
+                  None if event.get('event_id') is None else str(event['event_id']))
+                 for event in events]
+    except (KeyError, TypeError):
+        return jsonify({'error': 'Each pour needs a tap_id and a duration'}), 400
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    conn = get_db_connection()
+    applied = []
+    for tap_id, duration, device_ts, event_id in pours:
+        # Only pours that were logged just now take their volume off the tap
+        if conn.execute(POUR_INSERT_FROM_TAP, (event_id, device_ts, duration, duration, 'batch', tap_id)).rowcount:
+            applied.append((duration, tap_id))
+    conn.executemany(POUR_UPDATE, applied)
+
+    tap_ids = sorted({tap_id for tap_id, _, _, _ in pours})
+    volumes = {}
+    if tap_ids:
+        placeholders = ', '.join('?' * len(tap_ids))
+        volumes = {row['tap_id']: row['volume'] for row in
+                   conn.execute(f'SELECT tap_id, volume FROM taps WHERE tap_id IN ({placeholders})', tap_ids)}
+    conn.commit()
+    if applied:
+        taps_changed(conn)
+
+    return jsonify({
+        'success': True,
+        'accepted': len(applied),
+        'duplicates': sum(1 for tap_id, _, _, _ in pours if tap_id in volumes) - len(applied),
+        'new_volumes': volumes,
+        'unknown_taps': [tap_id for tap_id in tap_ids if tap_id not in volumes]
+    })
+
 if __name__ == '__main__':
-    # Check if database exists, if not initialize it
-    if not os.path.exists(app.config['DATABASE']):
-        init_db()
+    # Development server only; production runs under gunicorn (see gunicorn.conf.py)
+    prepare_db()
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,51 @@
+# gunicorn.conf.py - Production process model for the Keg Tap server
+#
+# A pre-fork master with a few worker processes, each running a pool of
+# threads (gthread) that keeps device connections alive between polls.
+# Every setting can be overridden from the environment, e.g. TAP_WORKERS=2.
+#
+# The database must be created or upgraded before the workers start:
+#   flask --app app init-db
+# The master deliberately never imports app.py, so a HUP (systemctl reload)
+# starts fresh workers on the current code and drains the old ones.
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+bind = os.environ.get('TAP_BIND', '0.0.0.0:5000')
+
+# SQLite allows one writer at a time, so more processes than cores only adds
+# lock contention; image resizing is what benefits from the extra processes.
+workers = int(os.environ.get('TAP_WORKERS', min(4, multiprocessing.cpu_count())))
+worker_class = 'gthread'
+# Each waiting long-poll (/api/tap/<id>/events) holds a thread, so size the
+# pool for the number of devices rather than for CPU.
+threads = int(os.environ.get('TAP_THREADS', 32))
+
+# Devices poll every few seconds; keep their connections open between requests
+keepalive = int(os.environ.get('TAP_KEEPALIVE', 75))
+# Long-polls last up to EVENTS_MAX_TIMEOUT (55s), let them finish on reload
+graceful_timeout = int(os.environ.get('TAP_GRACEFUL_TIMEOUT', 60))
+timeout = int(os.environ.get('TAP_TIMEOUT', 60))
+
+# Workers write their metrics here so /metrics can add them up; see metrics.share()
+metrics_dir = os.environ.setdefault('TAP_METRICS_DIR', os.path.join(tempfile.gettempdir(), 'keg_tap_metrics'))
+
+accesslog = os.environ.get('TAP_ACCESS_LOG')  # e.g. '-' for stdout
+errorlog = '-'
+proc_name = 'keg_tap_server'
+
+
+def on_starting(server):
+    # Counters start from zero with the server; a reload keeps them
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+def worker_exit(server, worker):
+    # Flush queued pours and finish queued image renders before the worker goes away
+    import app
+    app.pour_writer.close()
+    app.render_pool.close()
+    # Its final counts, which keep adding to the server's totals
+    app.metrics.publish()
@@ -0,0 +1,111 @@
+# image_cache.py - Disk-backed LRU cache for rendered image variants
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from image_utils import content_hash
+
+
+class ImageCache:
+    """Stores rendered variants of source images on disk, bounded by total size.
+
+    Entries are named ``<source prefix>_<variant digest>.<ext>``. The prefix is
+    derived from the source path so every variant of one image can be dropped
+    at once, and the digest covers the source's content hash plus the render
+    parameters, so a replaced source never matches a stale entry while one
+    that is only touched (uploaded again, say) keeps its variants. File
+    mtimes double as the LRU clock, which keeps the policy correct across
+    processes. A hit only moves the clock once touch_interval seconds have
+    passed since the last, so a busy entry isn't a metadata write per request.
+    """
+
+    def __init__(self, cache_dir, max_bytes, touch_interval=60):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.touch_interval = touch_interval
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def _source_prefix(source_path):
+        return hashlib.sha1(os.path.abspath(source_path).encode()).hexdigest()[:16]
+
+    def key_for(self, source_path, *params, ext='jpg'):
+        """Build the cache key for a variant of source_path rendered with params"""
+        variant = ':'.join(str(p) for p in (content_hash(source_path),) + params)
+        digest = hashlib.sha1(variant.encode()).hexdigest()[:24]
+        return f'{self._source_prefix(source_path)}_{digest}.{ext}'
+
+    def get(self, key):
+        """Return the path of a cached entry, or None on a miss"""
+        path = os.path.join(self.cache_dir, key)
+        try:
+            if time.time() - os.stat(path).st_mtime > self.touch_interval:
+                # Touch the entry so it becomes the most recently used
+                os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, data):
+        """Atomically store data under key and return the entry's path"""
+        path = os.path.join(self.cache_dir, key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        with self._lock:
+            self._evict()
+        return path
+
+    def get_or_render(self, key, render):
+        """Return the path for key, calling render() to produce the bytes on a miss"""
+        path = self.get(key)
+        if path is None:
+            path = self.put(key, render())
+        return path
+
+    def invalidate(self, source_path):
+        """Remove every cached variant of source_path"""
+        prefix = self._source_prefix(source_path) + '_'
+        with self._lock:
+            for path, size, _ in self._entries():
+                if os.path.basename(path).startswith(prefix):
+                    self._remove(path)
+
+    def _entries(self):
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield entry.path, st.st_size, st.st_mtime
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        # Scan the directory rather than keeping a running total: the other
+        # worker processes add to it too, and the bound is on all of them.
+        # Puts follow renders, so a scan is cheap next to what they cost.
+        entries = list(self._entries())
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        # Trim to 90% so we don't evict on every subsequent put
+        target = self.max_bytes * 0.9
+        for path, size, _ in sorted(entries, key=lambda e: e[2]):
+            if total <= target:
+                break
+            self._remove(path)
+            total -= size
@@ -0,0 +1,155 @@
+# image_store.py - Content-addressed storage for uploaded beer images
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+# <2 hex>/<2 hex>/<40 hex sha1>.<ext>, relative to the store root
+BLOB_NAME = re.compile(r'^([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{36}\.[a-z0-9]+$')
+# Ends the names of StagedFiles, which sit in the store root until they're committed
+STAGED_SUFFIX = '.tmp'
+
+
+class StagedFile:
+    """A file being written into an ImageStore, hashed as the bytes arrive.
+
+    It lives in the store's own directory so commit() is a rename, and is
+    deleted on close() unless it was committed. on_head, if given, is
+    called once with the first HEAD_SIZE bytes as soon as they are written,
+    so a caller can refuse a file before the rest of it arrives.
+    """
+
+    HEAD_SIZE = 16
+
+    def __init__(self, root, on_head=None):
+        fd, self.path = tempfile.mkstemp(dir=root, suffix=STAGED_SUFFIX)
+        self._file = os.fdopen(fd, 'w+b')
+        self._digest = hashlib.sha1()
+        self._on_head = on_head
+        self.head = b''
+        self.size = 0
+
+    def write(self, data):
+        if len(self.head) < self.HEAD_SIZE:
+            self.head += data[:self.HEAD_SIZE - len(self.head)]
+            if len(self.head) == self.HEAD_SIZE and self._on_head is not None:
+                self._on_head(self.head)
+        self._digest.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        """SHA-1 of everything written so far"""
+        return self._digest.hexdigest()
+
+    def __getattr__(self, name):
+        # read, seek, flush and the rest go to the underlying file
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def close(self):
+        self._file.close()
+        if self.path is not None:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ImageStore:
+    """Keeps each distinct upload once, named by the SHA-1 of its contents.
+
+    Blobs live under two levels of directories taken from the start of the
+    hash (ab/cd/abcd....jpg) so no single directory grows too large. Two
+    uploads with the same bytes share one blob, and a blob never changes
+    under its name, which is what lets it be served as immutable.
+    """
+
+    def __init__(self, root, chunk_size=64 * 1024):
+        self.root = os.path.abspath(root)
+        self.chunk_size = chunk_size
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def is_blob(name):
+        """Whether name (relative to the store root) is a content-addressed blob"""
+        return BLOB_NAME.match(name) is not None
+
+    @staticmethod
+    def is_legacy(name):
+        """Whether name is an image uploaded under its own filename, before content addressing.
+
+        Those sit in the store root, as do StagedFiles still being written,
+        which this leaves out.
+        """
+        return '/' not in name and not name.startswith('.') and not name.endswith(STAGED_SUFFIX)
+
+    def stage(self, on_head=None):
+        """A StagedFile in the store's directory, ready to be written and then commit()ted"""
+        return StagedFile(self.root, on_head)
+
+    def save(self, stream, ext):
+        """Store the bytes read from stream and return the blob's name relative to the root"""
+        with self.stage() as staged:
+            for chunk in iter(lambda: stream.read(self.chunk_size), b''):
+                staged.write(chunk)
+            return self.commit(staged, ext)
+
+    def commit(self, staged, ext):
+        """Move a fully written StagedFile into place and return the blob's name"""
+        staged.flush()
+        sha1 = staged.hexdigest()
+        name = f"{sha1[:2]}/{sha1[2:4]}/{sha1}.{ext.lower().lstrip('.')}"
+        path = os.path.join(self.root, name)
+        if os.path.exists(path):
+            # Already stored; touch it so a concurrent gc() treats it as new
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(staged.path, path)
+            staged.path = None
+        staged.close()
+        return name
+
+    def blobs(self):
+        """Yield (name, path, mtime) for every blob in the store"""
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                name = os.path.relpath(path, self.root).replace(os.sep, '/')
+                if self.is_blob(name):
+                    yield name, path, os.path.getmtime(path)
+
+    def gc(self, referenced, min_age=3600):
+        """Delete blobs not named in referenced and return the names removed.
+
+        Blobs younger than min_age seconds are kept, so an upload whose beer
+        row hasn't been committed yet isn't collected out from under it.
+        """
+        cutoff = time.time() - min_age
+        removed = []
+        for name, path, mtime in list(self.blobs()):
+            if name in referenced or mtime > cutoff:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            removed.append(name)
+            # Drop shard directories left empty
+            for directory in (os.path.dirname(path), os.path.dirname(os.path.dirname(path))):
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    break
+        return removed
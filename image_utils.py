@@ -0,0 +1,237 @@
+# image_utils.py - Pillow helpers for rendering beer images for the tap displays
+import functools
+import hashlib
+import io
+import math
+import os
+import time
+import zlib
+from PIL import Image, ImageChops, ImageDraw, ImageFont
+
+
+# Refuse to decode more pixels than this (about 72MB as RGB). A JPEG is
+# decoded at a fraction of its size when resized, so only what actually
+# gets decoded counts, not the size in its header.
+MAX_DECODED_PIXELS = 24_000_000
+# Header sizes Pillow will open at all; it warns above this and refuses twice it
+Image.MAX_IMAGE_PIXELS = 120_000_000
+
+# Shrink in cheap integer steps (DCT scaling while decoding a JPEG, then
+# reduce()) until the image is within this factor of the target size, and
+# leave only the last stretch to LANCZOS
+REDUCING_GAP = 2
+
+
+def resize_to_fill(img, width, height):
+    """Scale an image to cover width x height, then center-crop the overflow.
+
+    Pass an image straight from Image.open: a JPEG that hasn't been loaded
+    yet is decoded at 1/2, 1/4 or 1/8 scale instead of full size.
+    """
+    scale = max(width / img.width, height / img.height)
+    img.draft(None, (math.ceil(img.width * scale * REDUCING_GAP), math.ceil(img.height * scale * REDUCING_GAP)))
+    if img.width * img.height > MAX_DECODED_PIXELS:
+        raise Image.DecompressionBombError(f'{img.width}x{img.height} image is too large to resize')
+
+    # Convert mode before resizing/cropping
+    if img.mode in ("RGBA", "P"):
+        img = img.convert("RGB")
+
+    # The centered region of the source with the target's aspect ratio
+    src_width, src_height = img.size
+    if width / height > src_width / src_height:
+        crop_width, crop_height = src_width, src_width * height / width
+    else:
+        crop_width, crop_height = src_height * width / height, src_height
+    left = (src_width - crop_width) / 2
+    top = (src_height - crop_height) / 2
+
+    # resize() crops to box and reduce()s by whole factors before resampling
+    return img.resize((width, height), Image.LANCZOS, box=(left, top, left + crop_width, top + crop_height),
+                      reducing_gap=REDUCING_GAP)
+
+
+def rgb565_bytes(img):
+    """Pack an image as big-endian RGB565, the GC9A01's native pixel format"""
+    r, g, b = img.convert('RGB').split()
+    # rrrrrggg gggbbbbb: the bit fields don't overlap, so add() never clips
+    high = ImageChops.add(r.point(lambda v: v & 0xF8), g.point(lambda v: v >> 5))
+    low = ImageChops.add(g.point(lambda v: (v & 0x1C) << 3), b.point(lambda v: v >> 3))
+    # LA stores each pixel as its L byte followed by its A byte
+    return Image.merge('LA', (high, low)).tobytes()
+
+
+# Formats encode_image can produce, with their cache file extension and mimetype
+IMAGE_FORMATS = {
+    'jpeg': ('jpg', 'image/jpeg'),
+    'webp': ('webp', 'image/webp'),
+    'rgb565': ('rgb565', 'application/octet-stream'),
+    'rgb565-zlib': ('rgb565z', 'application/octet-stream'),
+}
+
+
+def encode_image(img, fmt, quality=85):
+    """Encode an image in one of IMAGE_FORMATS"""
+    if fmt in ('jpeg', 'webp'):
+        img_io = io.BytesIO()
+        img.convert('RGB').save(img_io, format=fmt.upper(), quality=quality)
+        return img_io.getvalue()
+    data = rgb565_bytes(img)
+    if fmt == 'rgb565-zlib':
+        data = zlib.compress(data, 9)
+    return data
+
+
+def render_variant(fmt, source_path, width, height, quality=85):
+    """Render source_path resized and cropped to width x height, encoded in one of IMAGE_FORMATS.
+
+    Returns the bytes and the (op, seconds) each step took. This runs in a
+    render process, so the timings go back to the server to be recorded.
+    """
+    with Image.open(source_path) as img:
+        start = time.perf_counter()
+        img = resize_to_fill(img, width, height)
+        resized = time.perf_counter()
+        data = encode_image(img, fmt, quality)
+    return data, (('resize', resized - start), ('encode', time.perf_counter() - resized))
+
+
+# Keg ring colors by remaining level, matching the device's level LEDs
+LEVEL_COLORS = ((25, (255, 0, 0)), (75, (255, 255, 0)), (100, (0, 255, 0)))
+RING_TRACK = (40, 40, 40, 200)
+RING_SUPERSAMPLE = 4  # Pillow's arcs aren't anti-aliased, so draw them large and scale down
+
+
+def load_font(font_path, size):
+    """A TrueType font at size, or Pillow's built-in font if font_path can't be loaded"""
+    if font_path:
+        try:
+            return ImageFont.truetype(font_path, size)
+        except OSError:
+            pass
+    return ImageFont.load_default(size)
+
+
+def fit_text(draw, text, font_path, max_width, size):
+    """Shrink text's font, then truncate it, until it is no wider than max_width"""
+    min_size = size * 2 // 3
+    font = load_font(font_path, size)
+    while draw.textlength(text, font=font) > max_width and size > min_size:
+        size -= 2
+        font = load_font(font_path, size)
+    if draw.textlength(text, font=font) > max_width:
+        while len(text) > 1 and draw.textlength(text + '\u2026', font=font) > max_width:
+            text = text[:-1]
+        text = text.rstrip() + '\u2026'
+    return text, font
+
+
+def compose_frame(img, name, abv, level, font_path=None):
+    """Draw the beer name, ABV and a keg-level ring over a square display image.
+
+    level is the percentage left in the keg. Text is kept inside the circle
+    of a round display.
+    """
+    width, height = img.size
+    radius = min(width, height) / 2
+    scale = radius / 120  # layout is designed for the 240x240 GC9A01
+    ring = round(8 * scale)
+    frame = img.convert('RGBA')
+
+    overlay = Image.new('RGBA', (width * RING_SUPERSAMPLE, height * RING_SUPERSAMPLE))
+    ring_draw = ImageDraw.Draw(overlay)
+    box = (RING_SUPERSAMPLE, RING_SUPERSAMPLE,
+           overlay.width - RING_SUPERSAMPLE - 1, overlay.height - RING_SUPERSAMPLE - 1)
+    ring_draw.ellipse(box, outline=RING_TRACK, width=ring * RING_SUPERSAMPLE)
+    if level > 0:
+        color = next(c for limit, c in LEVEL_COLORS if level <= limit)
+        ring_draw.arc(box, -90, -90 + 360 * level / 100, fill=color + (255,), width=ring * RING_SUPERSAMPLE)
+    frame.alpha_composite(overlay.resize((width, height), Image.LANCZOS))
+
+    draw = ImageDraw.Draw(frame)
+    inner = radius - ring - 6 * scale
+    for text, y, size in ((name, 55 * scale, round(30 * scale)), (abv, 185 * scale, round(24 * scale))):
+        if not text:
+            continue
+        # Width of the circle at the text's outer edge
+        dy = abs(y - height / 2) + size / 2
+        max_width = 2 * max(0, inner * inner - dy * dy) ** 0.5
+        text, font = fit_text(draw, text, font_path, max_width, size)
+        draw.text((width / 2, y), text, font=font, anchor='mm', fill='white',
+                  stroke_width=max(1, round(2 * scale)), stroke_fill='black')
+    return frame.convert('RGB')
+
+
+def render_frame(fmt, base_path, name, abv, level, quality=85, font_path=None):
+    """Compose a full-screen tap frame over an already resized image, encoded in one of IMAGE_FORMATS.
+
+    Returns the bytes and step timings, like render_variant().
+    """
+    with Image.open(base_path) as img:
+        start = time.perf_counter()
+        frame = compose_frame(img, name, abv, level, font_path)
+        composed = time.perf_counter()
+        data = encode_image(frame, fmt, quality)
+    return data, (('compose', composed - start), ('encode', time.perf_counter() - composed))
+
+
+@functools.lru_cache(maxsize=256)
+def _file_sha1(path, mtime_ns, size):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_hash(path):
+    """Return the SHA-1 of a file's contents, memoized on its mtime and size"""
+    st = os.stat(path)
+    return _file_sha1(path, st.st_mtime_ns, st.st_size)
+
+
+# Leading bytes of the image formats accepted for upload, with the extension each is stored under
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+
+
+def image_type(head):
+    """The extension for an image file starting with head, or None if it isn't a format we accept"""
+    for signature, ext in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def within_decode_limit(path):
+    """Whether resize_to_fill will take the image at path, judged from its header alone.
+
+    JPEGs are decoded scaled down, so only Pillow's header limit applies to
+    them; other formats are decoded whole and must fit MAX_DECODED_PIXELS.
+    Raises OSError if the header can't be read.
+    """
+    try:
+        with Image.open(path) as img:
+            limit = Image.MAX_IMAGE_PIXELS if img.format == 'JPEG' else MAX_DECODED_PIXELS
+            return img.width * img.height <= limit
+    except Image.DecompressionBombError:
+        return False
+
+
+@functools.lru_cache(maxsize=256)
+def _image_size(path, mtime_ns, size):
+    # Image.open only parses the header, the pixels are never decoded here
+    with Image.open(path) as img:
+        return img.size
+
+
+def image_size(path):
+    """Return an image file's (width, height), memoized on its mtime and size"""
+    st = os.stat(path)
+    return _image_size(path, st.st_mtime_ns, st.st_size)
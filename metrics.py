@@ -0,0 +1,209 @@
+# metrics.py - Low-overhead in-process metrics in Prometheus text format, optionally summed across processes
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from sub-millisecond cache hits up to slow SD card writes
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+_collectors = []  # functions that update metrics just before they're read
+_shared_path = None  # where this process publishes its metrics, once share()d
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class Metric:
+    """A counter or gauge, with one value per combination of label values"""
+
+    def __init__(self, name, help_text, labels=(), kind='counter'):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.kind = kind
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def set(self, value, *label_values):
+        self._values[label_values] = value
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(label_values), value] for label_values, value in self._values.items()]
+
+    def render(self, snapshots):
+        values = {}
+        for snapshot in snapshots:
+            for label_values, value in snapshot:
+                label_values = tuple(label_values)
+                values[label_values] = values.get(label_values, 0) + value
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for label_values, value in sorted(values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram, one per combination of label values"""
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(label_values), list(series)] for label_values, series in self._series.items()]
+
+    def render(self, snapshots):
+        merged = {}
+        for snapshot in snapshots:
+            for label_values, series in snapshot:
+                total = merged.setdefault(tuple(label_values), [0] * len(series))
+                for i, value in enumerate(series):
+                    total[i] += value
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for label_values, series in sorted(merged.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, [('le', bound)])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f'{self.name}_sum{labels} {series[-1]}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+def collector(func):
+    """Decorator: call func to bring metrics up to date each time they're read or published"""
+    _collectors.append(func)
+    return func
+
+
+def _snapshot():
+    for collect in _collectors:
+        collect()
+    return {metric.name: metric.snapshot() for metric in _registry}
+
+
+def share(directory, interval=5.0):
+    """Add up metrics across the processes sharing directory, such as gunicorn's workers.
+
+    Each process writes its metrics there every interval seconds and on
+    every render(), and render() sums what all of them have written, so a
+    scrape sees the whole server whichever worker answers it. Counters
+    and histograms of processes that have exited still count; their
+    gauges don't. Empty the directory when the server (not a worker) starts.
+    """
+    global _shared_path
+    os.makedirs(directory, exist_ok=True)
+    # The start time keeps a later process that reuses this pid from overwriting our counts
+    _shared_path = os.path.join(directory, f'{os.getpid()}-{time.time_ns()}.json')
+    publish()
+    threading.Thread(target=_publish_every, args=(interval,), name='metrics-publish', daemon=True).start()
+
+
+def _publish_every(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            publish()
+        except OSError as e:
+            print(f'Could not publish metrics: {e}')
+
+
+def publish():
+    """Write this process's metrics to the shared directory, if there is one"""
+    if _shared_path is None:
+        return
+    # Replaced by a rename, so readers never see a half-written file
+    with open(_shared_path + '.tmp', 'w') as f:
+        json.dump(_snapshot(), f)
+    os.replace(_shared_path + '.tmp', _shared_path)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _shared_snapshots():
+    directory = os.path.dirname(_shared_path)
+    gauges = {metric.name for metric in _registry if getattr(metric, 'kind', None) == 'gauge'}
+    snapshots = []
+    for name in os.listdir(directory):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if not _alive(int(name.split('-')[0])):
+            snapshot = {metric: values for metric, values in snapshot.items() if metric not in gauges}
+        snapshots.append(snapshot)
+    return snapshots
+
+
+def render():
+    """Every registered metric in Prometheus text exposition format, summed over shared processes"""
+    if _shared_path is None:
+        snapshots = [_snapshot()]
+    else:
+        publish()
+        snapshots = _shared_snapshots()
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render([snapshot.get(metric.name, []) for snapshot in snapshots]))
+    return '\n'.join(lines) + '\n'
+
+
+REQUESTS = Metric('tap_http_requests_total', 'HTTP requests handled', ('endpoint', 'method', 'status'))
+REQUEST_SECONDS = Histogram('tap_http_request_duration_seconds', 'Time to produce a response', ('endpoint',))
+RESPONSE_BYTES = Metric('tap_http_response_bytes_total', 'Response body bytes sent', ('endpoint',))
+IN_FLIGHT = Metric('tap_http_requests_in_flight', 'Requests currently being handled', kind='gauge')
+SQLITE_SECONDS = Histogram('tap_sqlite_seconds', 'Time spent in sqlite execute and commit calls', ('op',))
+PILLOW_SECONDS = Histogram('tap_pillow_seconds', 'Time spent resizing and encoding images', ('op',))
+RENDER_SECONDS = Histogram('tap_image_render_seconds', 'Time from queuing an image variant to having it cached')
+TAP_CACHE = Metric('tap_cache_lookups_total', 'Tap state cache lookups', ('result',))
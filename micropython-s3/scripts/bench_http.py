@@ -0,0 +1,111 @@
+# bench_http.py - Compare urequests with the keep-alive HTTPClient on the device
+#
+# Run on a board that already has the firmware modules from src/ installed:
+#   mpremote run micropython-s3/scripts/bench_http.py
+#
+# Joins Wi-Fi, then makes the same requests through urequests (a new DNS
+# lookup and TCP connection every time) and through http_client.HTTPClient
+# (one kept-alive connection): the tap info a refresh fetches, a pour
+# report, and the tap's image (urequests holds the whole body in the heap,
+# APIClient.download_file streams it to flash through a fixed buffer).
+# Prints the median and worst latency per request and the heap each
+# request allocates, plus the lowest free heap seen.
+import asyncio
+import gc
+import json
+import os
+import time
+import urequests as requests
+from config import SERVER_URL, TAP_ID, HTTP_TIMEOUT, IMAGE_DIR
+from api_client import APIClient
+from display_manager import DisplayManager
+from http_client import HTTPClient
+from wifi_manager import WiFiManager
+
+REQUESTS = 20
+
+TAP_PATH = f"/api/tap/{TAP_ID}"
+# The server only acknowledges a pour start, so benchmarking it records no pours
+POUR_PATH = f"/api/tap/{TAP_ID}/pour_event"
+POUR_BODY = json.dumps({"event_type": "start"})
+JSON_HEADERS = {"Content-Type": "application/json"}
+IMAGE_PATH = f"{IMAGE_DIR}/bench_download"
+
+
+async def urequests_get():
+    response = requests.get(SERVER_URL + TAP_PATH)
+    response.json()
+    response.close()
+
+
+async def urequests_post():
+    response = requests.post(SERVER_URL + POUR_PATH, headers=JSON_HEADERS, data=POUR_BODY)
+    response.close()
+
+
+async def urequests_image(url):
+    response = requests.get(SERVER_URL + url)
+    with open(IMAGE_PATH, "wb") as f:
+        f.write(response.content)
+    response.close()
+
+
+async def measure(label, request):
+    """Run request REQUESTS times and print its latency and heap use"""
+    times = []
+    allocated = []
+    lowest_free = gc.mem_free()
+    for _ in range(REQUESTS):
+        gc.collect()
+        before = gc.mem_alloc()
+        start = time.ticks_us()
+        await request()
+        times.append(time.ticks_diff(time.ticks_us(), start) / 1000)
+        # Nothing was collected since 'before', so this is everything the request allocated
+        allocated.append(gc.mem_alloc() - before)
+        lowest_free = min(lowest_free, gc.mem_free())
+    times.sort()
+    print(f"{label:<18}{times[len(times) // 2]:>10.1f}{times[-1]:>10.1f}"
+          f"{sum(allocated) // len(allocated):>12}{lowest_free:>12}")
+
+
+async def main():
+    display = DisplayManager()
+    display.init_display()
+    if not await WiFiManager(display).connect():
+        print("Wi-Fi connect failed")
+        return
+
+    client = HTTPClient(SERVER_URL, HTTP_TIMEOUT)
+
+    async def client_get():
+        response = await client.get(TAP_PATH)
+        await response.json()
+        await response.close()
+
+    async def client_post():
+        response = await client.post(POUR_PATH, POUR_BODY, JSON_HEADERS)
+        await response.close()
+
+    api = APIClient(display, None, None)
+    api.http = client
+    response = await client.get(api.tap_url())
+    image_url = (await response.json())['image']['url']
+    await response.close()
+
+    async def streamed_image():
+        await api.download_file(image_url, IMAGE_PATH)
+
+    print(f"{REQUESTS} requests each")
+    print(f"{'request':<18}{'median ms':>10}{'max ms':>10}{'alloc bytes':>12}{'min free':>12}")
+    await measure("urequests GET", urequests_get)
+    await measure("keep-alive GET", client_get)
+    await measure("urequests POST", urequests_post)
+    await measure("keep-alive POST", client_post)
+    await measure("urequests image", lambda: urequests_image(image_url))
+    await measure("streamed image", streamed_image)
+    client.close()
+    os.remove(IMAGE_PATH)
+
+
+asyncio.run(main())
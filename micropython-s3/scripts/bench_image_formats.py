@@ -0,0 +1,80 @@
+# bench_image_formats.py - Compare JPEG and RGB565 tap images on the device
+#
+# Run on a board that already has the firmware modules from src/ installed:
+#   mpremote run micropython-s3/scripts/bench_image_formats.py
+#
+# Joins Wi-Fi, downloads this tap's 240x240 image from the server as a JPEG,
+# raw RGB565 and zlib-compressed RGB565, then draws each one several times.
+# Prints the bytes transferred, download time and median draw time per
+# format, plus the JPEG decoder's SLOW/FAST modes for comparison.
+import asyncio
+import gc
+import os
+import time
+import urequests as requests
+import gc9a01
+from config import SERVER_URL, TAP_ID, IMAGE_DIR, DISPLAY_WIDTH, DISPLAY_HEIGHT
+from display_manager import DisplayManager
+from wifi_manager import WiFiManager
+
+DRAWS = 5
+
+# name, query arguments, file extension
+FORMATS = [
+    ("jpeg", "", "jpg"),
+    ("rgb565", "&format=rgb565", "rgb565"),
+    ("rgb565-zlib", "&format=rgb565&compress=zlib", "rgb565z"),
+]
+
+
+def download(query, path):
+    url = f"{SERVER_URL}/api/tap/{TAP_ID}/image?width={DISPLAY_WIDTH}&height={DISPLAY_HEIGHT}{query}"
+    gc.collect()
+    start = time.ticks_ms()
+    response = requests.get(url)
+    data = response.content
+    response.close()
+    elapsed = time.ticks_diff(time.ticks_ms(), start)
+    if response.status_code != 200:
+        raise OSError(f"GET {url} returned {response.status_code}")
+    with open(path, "wb") as f:
+        f.write(data)
+    return len(data), elapsed
+
+
+def median_draw_ms(draw):
+    times = []
+    for _ in range(DRAWS):
+        gc.collect()
+        start = time.ticks_us()
+        draw()
+        times.append(time.ticks_diff(time.ticks_us(), start) / 1000)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def main():
+    display = DisplayManager()
+    if not display.init_display():
+        print("Display init failed")
+        return
+    if not asyncio.run(WiFiManager(display).connect()):
+        print("Wi-Fi connect failed")
+        return
+
+    print(f"{'format':<14}{'bytes':>8}{'download ms':>13}{'draw ms':>10}")
+    for name, query, ext in FORMATS:
+        path = f"{IMAGE_DIR}/bench.{ext}"
+        size, download_ms = download(query, path)
+        if ext == "jpg":
+            modes = [("jpeg SLOW", gc9a01.SLOW), ("jpeg FAST", gc9a01.FAST)]
+            for label, mode in modes:
+                draw_ms = median_draw_ms(lambda: display.tft.jpg(path, 0, 0, mode))
+                print(f"{label:<14}{size:>8}{download_ms:>13}{draw_ms:>10.1f}")
+        else:
+            draw_ms = median_draw_ms(lambda: display.draw_rgb565(path))
+            print(f"{name:<14}{size:>8}{download_ms:>13}{draw_ms:>10.1f}")
+        os.remove(path)
+
+
+main()
@@ -1,18 +1,42 @@
-# network_manager.py - Network and API management
+# api_client.py - Tap server API: tap info, beer images and queued pours
 
-import network
-import urequests as requests
+import asyncio
+import binascii
+import hashlib
 import json
 import os
 import time
-from config import (WIFI_SSID, WIFI_PASSWORD, SERVER_URL, TAP_ID,
-                    IMAGE_DIR, USE_SERVER_RESIZE, DISPLAY_WIDTH, DISPLAY_HEIGHT)
+from config import (SERVER_URL, TAP_ID, HTTP_TIMEOUT, PUSH_TIMEOUT, STATUS_RED,
+                    IMAGE_DIR, IMAGE_FORMAT, IMAGE_COMPRESS, IMAGE_CACHE_DIR, IMAGE_CACHE_RESERVE, TAP_INFO_FILE,
+                    USE_SERVER_RESIZE, USE_SERVER_FRAMES, DISPLAY_WIDTH, DISPLAY_HEIGHT, DOWNLOAD_BUFFER_SIZE,
+                    POUR_QUEUE_FILE, POUR_QUEUE_SLOTS, POUR_BATCH_SIZE, POUR_RETRY_MIN, POUR_RETRY_MAX)
+from http_client import HTTPClient
+from image_cache import ImageCache
+from pour_queue import PourQueue
 
-import urequests as requests
-import json
-import os
-from config import SERVER_URL, TAP_ID, IMAGE_DIR, USE_SERVER_RESIZE, DISPLAY_WIDTH, DISPLAY_HEIGHT
-from config import STATUS_YELLOW, STATUS_RED
+# Composited frames are a server-resize feature
+SERVER_FRAMES = USE_SERVER_RESIZE and USE_SERVER_FRAMES
+
+# MicroPython on the ESP32 counts time from 2000 rather than 1970
+EPOCH_OFFSET = 946684800 if time.gmtime(0)[0] == 2000 else 0
+# Any earlier reading means the clock was never set (2024-01-01, unix time)
+CLOCK_SET_AFTER = 1704067200
+
+def unix_time(device_time):
+    """A device clock reading as unix time, or None if the clock wasn't set when it was taken"""
+    unix = device_time + EPOCH_OFFSET
+    return unix if unix >= CLOCK_SET_AFTER else None
+
+def tap_info_key(data):
+    """What of the tap info has to change for it to be saved to flash again"""
+    return (data.get('beer_name'), data.get('beer_abv'), data.get('image_path'), data.get('image'))
+
+def remove_file(path):
+    """Delete a file if it exists"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
 
 class APIClient:
     def __init__(self, display_manager, led_controller, battery_monitor):
@@ -20,41 +44,59 @@ class APIClient:
         self.led_controller = led_controller
         self.battery_monitor = battery_monitor
         self.current_beer = None
+        # ETag of the last tap info we received, for conditional GETs
+        self.tap_etag = None
+        # tap_info_key() of the tap info last saved to flash
+        self.saved_tap_info = None
+        # Kept-alive connections to the server for every request
+        self.http = HTTPClient(SERVER_URL, HTTP_TIMEOUT)
+        # Every download streams through this one buffer, whatever the image's size
+        self.download_buffer = memoryview(bytearray(DOWNLOAD_BUFFER_SIZE))
+        # Downloaded images by content hash, so a beer seen before needs no download
+        self.image_cache = ImageCache(IMAGE_CACHE_DIR, IMAGE_CACHE_RESERVE)
+        # Pours are kept in flash until the server acknowledges them
+        self.pour_queue = PourQueue(POUR_QUEUE_FILE, POUR_QUEUE_SLOTS)
+        self.flush_backoff = 0
+        # Set when a pour is queued, to wake upload_pours()
+        self.pours_waiting = asyncio.Event()
 
-    def fetch_tap_info(self):
+    def get_etag(self, response):
+        """Return the ETag header of a response, if the server sent one"""
+        headers = getattr(response, 'headers', None) or {}
+        return headers.get('ETag') or headers.get('etag')
+
+    async def fetch_tap_info(self):
         """Fetch tap information from the server"""
         try:
             print("Fetching tap info...")
-            self.display_manager.display_message("Fetching tap info...")
+            headers = {}
+            if self.current_beer and self.tap_etag:
+                # Only ask for a new body if the tap changed since our last fetch
+                headers['If-None-Match'] = self.tap_etag
+            else:
+                self.display_manager.display_message("Fetching tap info...")
             # Keep status LED yellow while fetching
             self.led_controller.start_connection_battery_display(self.battery_monitor)
 
-            response = requests.get(f"{SERVER_URL}/api/tap/{TAP_ID}")
+            response = await self.http.get(self.tap_url(), headers=headers)
 
             print(f"Response code {response.status_code}...")
-            if response.status_code == 200:
-                data = response.json()
-                self.current_beer = data
-                print("Tap info:", data)
-
-                # Download the beer image if it exists
-                if data['image_path']:
-                    self.download_beer_image()
-
-                print("Retrieved image, displaying tap info")
+            if response.status_code == 304:
+                await response.close()
+                print("Tap info unchanged")
                 self.led_controller.stop_connection_battery_display()
-                self.display_manager.display_tap_info(data)
-                # Calculate remaining beer percentage
-                if self.current_beer['volume'] > 0:
-                    remaining_percent = min(100, int((self.current_beer['volume'] / self.current_beer['full_volume']) * 100))
-                else:
-                    remaining_percent = 0
-
-                # Update the keg level LEDs
-
-                self.led_controller.set_keg_level_leds(remaining_percent)
+                # The screen is current, but the LEDs were showing the battery
+                self.show_keg_level()
+                return True, self.current_beer
+            elif response.status_code == 200:
+                data = await response.json()
+                self.tap_etag = self.get_etag(response)
+                await response.close()
+                self.led_controller.stop_connection_battery_display()
+                await self.show_tap_info(data)
                 return True, data
             else:
+                await response.close()
                 print(f"Error fetching tap info: {response.status_code}")
                 self.display_manager.display_message(f"Error: {response.status_code}")
                 self.led_controller.stop_connection_battery_display()
@@ -67,31 +109,216 @@ class APIClient:
             self.led_controller.set_status_led(STATUS_RED)
             return False, None
 
-    def download_beer_image(self):
-        """Download the beer image from the server"""
+    async def show_tap_info(self, data):
+        """Make data the current tap info and bring the screen and LEDs up to date"""
+        self.current_beer = data
+        print("Tap info:", data)
+
+        # Download the beer image if it exists; a server frame is drawn even without one
+        if data['image_path'] or SERVER_FRAMES:
+            await self.download_beer_image()
+
+        print("Retrieved image, displaying tap info")
+        self.display_manager.display_tap_info(data)
+        self.show_keg_level()
+        self.save_tap_info()
+
+    def show_keg_level(self):
+        """Show how full the keg is on the LEDs"""
+        # Calculate remaining beer percentage
+        if self.current_beer['volume'] > 0:
+            remaining_percent = min(100, int((self.current_beer['volume'] / self.current_beer['full_volume']) * 100))
+        else:
+            remaining_percent = 0
+
+        # Update the keg level LEDs
+        self.led_controller.set_keg_level_leds(remaining_percent)
+
+    def save_tap_info(self):
+        """Keep the current tap info in flash for show_cached_tap_info() after a reboot.
+
+        Only rewritten when the beer or its image changed: a pour that just
+        moves the level isn't worth a flash write, and the first fetch after
+        a reboot brings the level up to date anyway.
+        """
+        saved = tap_info_key(self.current_beer)
+        if saved == self.saved_tap_info:
+            return
         try:
+            with open(TAP_INFO_FILE + ".tmp", "w") as f:
+                json.dump({'etag': self.tap_etag, 'data': self.current_beer}, f)
+            os.rename(TAP_INFO_FILE + ".tmp", TAP_INFO_FILE)
+            self.saved_tap_info = saved
+        except OSError as e:
+            print("Error saving tap info:", e)
+
+    def show_cached_tap_info(self):
+        """Draw the tap info saved before the last reboot, if its image is still in the cache.
+
+        Needs no network, so it can run before Wi-Fi is up. Returns True if
+        the screen now shows it; the first fetch then sends its ETag and is
+        answered 304 unless the tap changed meanwhile.
+        """
+        try:
+            with open(TAP_INFO_FILE) as f:
+                saved = json.load(f)
+            data = saved['data']
+            image = data.get('image')
+        except (OSError, ValueError, KeyError, AttributeError):
+            return False
+        path = self.image_cache.get(image['hash']) if image else None
+        if not path:
+            return False
+
+        print("Showing cached tap info")
+        self.current_beer = data
+        self.tap_etag = saved['etag']
+        self.saved_tap_info = tap_info_key(data)
+        self.display_manager.set_last_image(path, SERVER_FRAMES)
+        self.display_manager.display_tap_info(data)
+        self.show_keg_level()
+        return True
+
+    async def wait_for_tap_change(self):
+        """Wait on the server's long-poll channel until our tap changes.
+
+        Returns True if the tap was updated, False if the wait timed out with
+        nothing new, and None on errors so the caller can back off.
+        """
+        try:
+            version = self.current_beer.get('version', -1) if self.current_beer else -1
+            url = self.tap_url("/events")
+            url += f"{'&' if '?' in url else '?'}since={version}&timeout={PUSH_TIMEOUT}"
+            response = await self.http.get(url, timeout=PUSH_TIMEOUT + 10)
+
+            if response.status_code == 204:
+                await response.close()
+                return False
+            elif response.status_code == 200:
+                data = await response.json()
+                self.tap_etag = self.get_etag(response)
+                await response.close()
+                print("Tap changed on server")
+                await self.show_tap_info(data)
+                return True
+            else:
+                print(f"Error waiting for tap changes: {response.status_code}")
+                await response.close()
+                return None
+        except Exception as e:
+            print("Error waiting for tap changes:", e)
+            return None
+
+    def tap_url(self, path=""):
+        """Server path of a tap endpoint, asking for the image manifest at our display size"""
+        url = f"/api/tap/{TAP_ID}{path}"
+        if USE_SERVER_RESIZE:
+            url += f"?width={DISPLAY_WIDTH}&height={DISPLAY_HEIGHT}"
+            if IMAGE_FORMAT == "rgb565":
+                url += "&format=rgb565&compress=zlib" if IMAGE_COMPRESS else "&format=rgb565"
+            if SERVER_FRAMES:
+                # The image manifest then describes the composited frame
+                url += "&view=frame"
+        return url
+
+    def local_image_path(self):
+        """Where the image variant we ask for is kept when there's no manifest to cache it by"""
+        if USE_SERVER_RESIZE:
+            name = "frame" if SERVER_FRAMES else "resized"
+            if IMAGE_FORMAT == "rgb565":
+                # Raw pixels are stored as downloaded and only inflated while drawing
+                return f"{IMAGE_DIR}/{TAP_ID}_{name}.{'rgb565z' if IMAGE_COMPRESS else 'rgb565'}"
+            return f"{IMAGE_DIR}/{TAP_ID}_{name}.jpg"
+        return f"{IMAGE_DIR}/{TAP_ID}.jpg"
+
+    async def download_file(self, url, path, image=None):
+        """Stream url into the file at path through the reusable download buffer.
+
+        The body goes to path + ".tmp" and is renamed to path only once it
+        is complete: as long as Content-Length says and, when image (a manifest
+        entry) is given, of its size and SHA-1. Anything else leaves path as it
+        was. Returns the SHA-1 of what was saved, or None.
+        """
+        temp_path = path + ".tmp"
+        buf = self.download_buffer
+        digest = hashlib.sha1()
+        size = 0
+        response = await self.http.get(url)
+        try:
+            if response.status_code != 200:
+                print(f"Error downloading {url}: {response.status_code}")
+                return None
+            try:
+                with open(temp_path, 'wb') as f:
+                    while True:
+                        n = await response.readinto(buf)
+                        if not n:
+                            break
+                        f.write(buf[:n])
+                        digest.update(buf[:n])
+                        size += n
+            except Exception:
+                remove_file(temp_path)
+                raise
+        finally:
+            await response.close()
+
+        sha1 = binascii.hexlify(digest.digest()).decode()
+        expected_size = response.headers.get('content-length')
+        if expected_size is not None and size != int(expected_size):
+            problem = f"got {size} of {expected_size} bytes"
+        elif image and size != image['size']:
+            problem = f"got {size} bytes, manifest says {image['size']}"
+        elif image and sha1 != image['hash']:
+            problem = f"SHA-1 {sha1} doesn't match manifest {image['hash']}"
+        else:
+            # A power cut after this leaves either the old file or the new one, never half of one
+            os.rename(temp_path, path)
+            return sha1
+        print(f"Discarding download of {url}: {problem}")
+        remove_file(temp_path)
+        return None
+
+    async def download_image(self, url, local_path, image=None):
+        """Download an image and return where it was saved, or None.
+
+        An image described by a manifest entry goes into the image cache
+        under its hash. Without one there's nothing to cache it by, so it
+        goes to local_path, replacing the previous download.
+        """
+        if not image:
+            return local_path if await self.download_file(url, local_path) else None
+        if not self.image_cache.make_room(image['size']):
+            print("Not enough flash for the image")
+            return None
+        path = self.image_cache.new_path(image['hash'], local_path.rsplit('.', 1)[1])
+        if not await self.download_file(url, path, image):
+            return None
+        self.image_cache.add(image['hash'], path, image['size'])
+        return path
+
+    async def download_beer_image(self):
+        """Get the beer image ready to draw, from the image cache if it's there"""
+        try:
+            image = self.current_beer.get('image') if self.current_beer else None
+            cached_path = self.image_cache.get(image['hash']) if image else None
+            if cached_path:
+                print("Image in the cache, no download needed")
+                self.display_manager.set_last_image(cached_path, SERVER_FRAMES)
+                return True, cached_path
+
             # First attempt: Try to get a server-resized image if the feature is enabled
             if USE_SERVER_RESIZE:
                 try:
-                    # Request pre-scaled image from server
-                    resized_image_path = f"{IMAGE_DIR}/{TAP_ID}_resized.jpg"
-
-                    # Remove existing image if it exists
-                    try:
-                        os.remove(resized_image_path)
-                    except:
-                        pass
-
                     # Request resized image
                     print("Requesting resized image from server...")
-                    response = requests.get(
-                        f"{SERVER_URL}/api/tap/{TAP_ID}/image?width={DISPLAY_WIDTH}&height={DISPLAY_HEIGHT}")
+                    # The manifest's URL is the exact variant (or frame) it describes
+                    url = image['url'] if image else self.tap_url("/frame" if SERVER_FRAMES else "/image")
+                    resized_image_path = await self.download_image(url, self.local_image_path(), image)
 
-                    if response.status_code == 200:
-                        with open(resized_image_path, 'wb') as f:
-                            f.write(response.content)
+                    if resized_image_path:
                         print(f"Resized image downloaded to {resized_image_path}")
-                        self.display_manager.set_last_image(resized_image_path)
+                        self.display_manager.set_last_image(resized_image_path, SERVER_FRAMES)
                         return True, resized_image_path
                     else:
                         print("Server resize failed, falling back to original image")
@@ -100,53 +327,76 @@ class APIClient:
                     print("Error with server resize:", e)
                     # Fall through to download original image
 
-            # Download the original image if server resize failed or is disabled
-            image_path = f"{IMAGE_DIR}/{TAP_ID}.jpg"
+            # Download the original image if server resize failed or is disabled;
+            # the manifest only describes the original when we didn't ask for a resize
+            image_path = await self.download_image(f"/api/tap/{TAP_ID}/image", f"{IMAGE_DIR}/{TAP_ID}.jpg",
+                                                   None if USE_SERVER_RESIZE else image)
 
-            # Delete existing image if exists
-            try:
-                os.remove(image_path)
-            except:
-                pass
-
-            # Download new image
-            response = requests.get(f"{SERVER_URL}/api/tap/{TAP_ID}/image")
-
-            if response.status_code == 200:
-                with open(image_path, 'wb') as f:
-                    f.write(response.content)
+            if image_path:
                 print(f"Image downloaded to {image_path}")
                 self.display_manager.set_last_image(image_path)
                 return True, image_path
             else:
-                print(f"Error downloading image: {response.status_code}")
+                # Whatever flash holds is some earlier beer's image; show none instead
+                self.display_manager.set_last_image(None)
                 return False, None
         except Exception as e:
             print("Error downloading image:", e)
+            self.display_manager.set_last_image(None)
             return False, None
 
-    def report_pour_event(self, event_type, duration=None):
-        """Report pour event to the server"""
-        try:
-            if event_type == "start":
-                data = {"event_type": "start"}
-            else:
-                data = {"event_type": "stop", "duration": duration}
+    def report_pour(self, duration):
+        """Record a finished pour in the flash queue and wake upload_pours() to send it"""
+        self.pour_queue.append(int(time.time()), int(duration * 1000))
+        self.pours_waiting.set()
 
-            response = requests.post(
-                f"{SERVER_URL}/api/tap/{TAP_ID}/pour_event",
-                headers={'Content-Type': 'application/json'},
-                data=json.dumps(data)
-            )
+    async def upload_pours(self):
+        """Task: upload the pour queue whenever a pour is added, retrying failed uploads.
 
-            if response.status_code == 200:
-                print(f"Pour event reported: {event_type}")
-                return True
+        After a failure, uploads wait out a backoff that doubles up to
+        POUR_RETRY_MAX; pours that stop meanwhile wait in flash with the rest.
+        """
+        while True:
+            # Cleared first, so a pour queued during the upload starts another round
+            self.pours_waiting.clear()
+            if await self.flush_pours():
+                await self.pours_waiting.wait()
             else:
-                print(f"Error reporting pour event: {response.status_code}")
-                return False
+                await asyncio.sleep(self.flush_backoff)
+
+    async def flush_pours(self):
+        """Upload queued pours in batches until none are left or the server can't be reached.
+
+        A batch leaves the queue only once the server has acknowledged it
+        and recorded it against this tap. Returns True when the queue is empty.
+        """
+        try:
+            while len(self.pour_queue):
+                records, through = self.pour_queue.peek(POUR_BATCH_SIZE)
+                if records:
+                    pours = [{"tap_id": TAP_ID,
+                              "event_id": f"{self.pour_queue.queue_id:08x}-{seq}",
+                              "duration": duration_ms / 1000,
+                              "timestamp": unix_time(timestamp)}
+                             for seq, timestamp, duration_ms in records]
+                    response = await self.http.post("/api/pours/batch", json.dumps({"pours": pours}),
+                                                    {'Content-Type': 'application/json'})
+                    try:
+                        if response.status_code != 200:
+                            raise OSError(f"server answered {response.status_code}")
+                        result = await response.json()
+                    finally:
+                        await response.close()
+                    # The server skips pours for taps it doesn't know; keep ours until it does
+                    if TAP_ID in result.get("unknown_taps", ()):
+                        raise ValueError(f"server doesn't know tap {TAP_ID}")
+                self.pour_queue.ack(through)
+                print(f"Uploaded {len(records)} pours, {len(self.pour_queue)} still queued")
+            self.flush_backoff = 0
+            return True
         except Exception as e:
-            print("Error reporting pour event:", e)
+            self.flush_backoff = min(max(2 * self.flush_backoff, POUR_RETRY_MIN), POUR_RETRY_MAX)
+            print(f"Error uploading pours, retrying in {self.flush_backoff}s:", e)
             return False
 
     def is_connected(self):
@@ -1,7 +1,8 @@
 # battery_monitor.py - Battery monitoring functionality
+import asyncio
 import time
 from machine import Pin, ADC
-from config import BATTERY_ADC_PIN, BATTERY_MIN_VOLTAGE, BATTERY_MAX_VOLTAGE
+from config import BATTERY_ADC_PIN, BATTERY_MIN_VOLTAGE, BATTERY_MAX_VOLTAGE, BATTERY_SAMPLE_INTERVAL
 
 class BatteryMonitor:
     def __init__(self):
@@ -49,19 +50,41 @@ class BatteryMonitor:
                 readings.append(raw_value)
                 time.sleep_ms(10)
 
-            avg_reading = sum(readings) / len(readings)
-
-            # Use the conversion formula from the wiki:
-            # voltage = 3.3 / (1<<12) * 3 * AD_Value
-            # This accounts for the 200K+100K voltage divider (factor of 3)
-            voltage = (3.3 / (1 << 12)) * 3 * avg_reading
-
-            self.battery_voltage = voltage
-            return voltage
+            return self.voltage_from_readings(readings)
         except Exception as e:
             print(f"Error reading battery voltage: {e}")
             return 0.0
 
+    def voltage_from_readings(self, readings):
+        """Average raw ADC readings into the battery voltage, and remember it"""
+        avg_reading = sum(readings) / len(readings)
+
+        # Use the conversion formula from the wiki:
+        # voltage = 3.3 / (1<<12) * 3 * AD_Value
+        # This accounts for the 200K+100K voltage divider (factor of 3)
+        voltage = (3.3 / (1 << 12)) * 3 * avg_reading
+
+        self.battery_voltage = voltage
+        return voltage
+
+    async def run(self):
+        """Task: re-read the battery every BATTERY_SAMPLE_INTERVAL seconds.
+
+        get_battery_status() reports the latest of these readings, so the
+        LED animation and display never wait on the ADC.
+        """
+        while self.battery_adc and self.battery_connected:
+            await asyncio.sleep(BATTERY_SAMPLE_INTERVAL)
+            try:
+                readings = []
+                for _ in range(5):
+                    readings.append(self.battery_adc.read())
+                    await asyncio.sleep_ms(10)
+                self.voltage_from_readings(readings)
+                self.calculate_battery_percentage()
+            except Exception as e:
+                print(f"Error reading battery voltage: {e}")
+
     def calculate_battery_percentage(self):
         """Calculate battery percentage based on voltage"""
         if not self.battery_connected or self.battery_voltage == 0:
@@ -81,7 +104,7 @@ class BatteryMonitor:
         return self.battery_percentage
 
     def get_battery_status(self):
-        """Get complete battery status"""
+        """Get complete battery status, as of the last reading"""
         if not self.battery_connected:
             return {
                 'connected': False,
@@ -90,7 +113,7 @@ class BatteryMonitor:
                 'status': 'Not connected'
             }
 
-        voltage = self.read_battery_voltage()
+        voltage = self.battery_voltage
         percentage = self.calculate_battery_percentage()
 
         # Determine status
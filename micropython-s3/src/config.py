@@ -7,6 +7,16 @@ WIFI_PASSWORD = "thescaryd00r"
 # Server Configuration
 SERVER_URL = "http://beerpi.kenandmidi.com:5000"  # Replace with your Raspberry Pi IP
 TAP_ID = "tap_1"  # Can be modified for each device
+USE_PUSH_UPDATES = True  # Wait on the server's long-poll channel instead of refreshing every minute
+PUSH_TIMEOUT = 30  # seconds the server may hold each long-poll before answering "no change"
+HTTP_TIMEOUT = 10  # seconds to wait on the server for any other request
+
+# Pour Queue Configuration
+POUR_QUEUE_FILE = "/pour_queue.bin"  # pours waiting for the server, kept in flash across reboots
+POUR_QUEUE_SLOTS = 256  # pours the queue holds before the oldest is overwritten
+POUR_BATCH_SIZE = 32  # pours uploaded per request
+POUR_RETRY_MIN = 5  # seconds before retrying a failed upload, doubling on each failure
+POUR_RETRY_MAX = 300
 
 # Display Configuration
 DISPLAY_WIDTH = 240
@@ -36,8 +46,17 @@ KEG_EMPTY = (0, 0, 0)         # Off for empty
 BATTERY_ADC_PIN = 1  # GPIO1 - battery voltage measurement pin per wiki
 BATTERY_MIN_VOLTAGE = 3.2  # Minimum safe voltage (adjust based on your battery)
 BATTERY_MAX_VOLTAGE = 4.2  # Maximum voltage for LiPo battery (adjust if different)
+BATTERY_SAMPLE_INTERVAL = 30  # seconds between battery readings
 # Voltage divider: 200K + 100K resistors, so divider ratio is (200K+100K)/100K = 3.0
 
 # Image Configuration
-IMAGE_DIR = "/images"
-USE_SERVER_RESIZE = True  # Set to False if your server doesn't support this feature
\ No newline at end of file
+IMAGE_DIR = "/images"  # images downloaded without a manifest, one per tap and variant
+IMAGE_CACHE_DIR = "/image_cache"  # image cache, one file per distinct image; holds nothing else
+IMAGE_CACHE_RESERVE = 256 * 1024  # bytes of flash the image cache leaves free for everything else
+TAP_INFO_FILE = "/tap_info.json"  # last tap info, drawn from flash at boot before Wi-Fi is up
+USE_SERVER_RESIZE = True  # Set to False if your server doesn't support this feature
+IMAGE_FORMAT = "rgb565"  # "rgb565" streams raw pixels to the panel, "jpeg" decodes a JPEG on the device
+IMAGE_COMPRESS = False  # zlib-compress rgb565 downloads; needs firmware with the deflate module
+IMAGE_CHUNK_ROWS = 16  # display rows drawn per blit_buffer call for rgb565 images
+DOWNLOAD_BUFFER_SIZE = 4096  # bytes read from the socket per write to flash while downloading
+USE_SERVER_FRAMES = True  # Draw the server-composited screen (image, name, ABV, keg ring) instead of drawing text here
\ No newline at end of file
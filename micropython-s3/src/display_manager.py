@@ -2,14 +2,17 @@
 import os
 from machine import Pin, SPI
 import gc9a01
-from truetype import NotoSans_32 as noto_sans
-from config import DISPLAY_WIDTH, DISPLAY_HEIGHT, IMAGE_DIR
+from config import DISPLAY_WIDTH, DISPLAY_HEIGHT, IMAGE_DIR, IMAGE_CHUNK_ROWS
 
 class DisplayManager:
     def __init__(self):
         self.tft = None
         self.last_image = None
+        self.last_image_is_frame = False
         self.current_beer = None
+        self._font = None
+        # Band of display rows for drawing raw RGB565 images, allocated once
+        self.row_buffer = bytearray(DISPLAY_WIDTH * 2 * IMAGE_CHUNK_ROWS)
 
         # Create image directory
         try:
@@ -45,6 +48,17 @@ class DisplayManager:
             print("Display initialization error:", e)
             return False
 
+    def font(self):
+        """The NotoSans_32 bitmap font, imported on first use.
+
+        A device drawing server-composited frames only needs it for status
+        messages, and never loads it if nothing goes wrong after boot.
+        """
+        if self._font is None:
+            from truetype import NotoSans_32
+            self._font = NotoSans_32
+        return self._font
+
     def center(self, font, s, row, color=gc9a01.WHITE):
         """Center text on the display"""
         screen = self.tft.width()                     # get screen width
@@ -59,7 +73,7 @@ class DisplayManager:
     def display_message(self, message, y_pos=120):
         """Display a centered message on the screen"""
         if self.tft:
-            self.center(noto_sans, message, y_pos, gc9a01.RED)
+            self.center(self.font(), message, y_pos, gc9a01.RED)
 
     def get_jpeg_dimensions(self, filename):
         """
@@ -107,6 +121,35 @@ class DisplayManager:
             print("Error reading JPEG dimensions:", e)
             return None
 
+    def draw_rgb565(self, filename):
+        """Stream a full-screen big-endian RGB565 image from flash to the panel.
+
+        Files ending in .rgb565z are zlib-compressed and inflated on the fly.
+        Nothing is decoded: rows are copied in IMAGE_CHUNK_ROWS bands straight
+        into blit_buffer.
+        """
+        row_bytes = DISPLAY_WIDTH * 2
+        buf = memoryview(self.row_buffer)
+        with open(filename, "rb") as f:
+            stream = f
+            if filename.endswith(".rgb565z"):
+                import deflate
+                stream = deflate.DeflateIO(f, deflate.ZLIB)
+
+            y = 0
+            while y < DISPLAY_HEIGHT:
+                rows = min(IMAGE_CHUNK_ROWS, DISPLAY_HEIGHT - y)
+                band = buf[:rows * row_bytes]
+                # readinto may return short counts, especially from DeflateIO
+                filled = 0
+                while filled < len(band):
+                    n = stream.readinto(band[filled:])
+                    if not n:
+                        raise ValueError("Truncated RGB565 image")
+                    filled += n
+                self.tft.blit_buffer(band, 0, y, DISPLAY_WIDTH, rows)
+                y += rows
+
     def display_tap_info(self, beer_data, battery_info=None):
         """Display the current tap information and beer image"""
         if not self.tft or not beer_data:
@@ -114,11 +157,27 @@ class DisplayManager:
 
         self.current_beer = beer_data
 
+        if self.last_image_is_frame:
+            # The server drew the whole screen, text and keg ring included
+            try:
+                if self.last_image.endswith(".jpg"):
+                    self.tft.jpg(self.last_image, 0, 0, gc9a01.SLOW)
+                else:
+                    self.draw_rgb565(self.last_image)
+                return
+            except Exception as e:
+                print("Error displaying frame:", e)
+
         # Clear the screen
         self.tft.fill(0)
 
         # Display beer image if available
-        if self.last_image:
+        if self.last_image and (self.last_image.endswith(".rgb565") or self.last_image.endswith(".rgb565z")):
+            try:
+                self.draw_rgb565(self.last_image)
+            except Exception as e:
+                print("Error displaying image:", e)
+        elif self.last_image:
             try:
                 # Get image dimensions
                 dimensions = self.get_jpeg_dimensions(self.last_image)
@@ -156,14 +215,16 @@ class DisplayManager:
             print("ERROR! Last image not found!")
 
         # Display beer information as overlay
-        self.center(noto_sans, beer_data['beer_name'] or "No beer", 50, gc9a01.WHITE)
-        self.center(noto_sans, f"{beer_data['beer_abv']}% ABV" if beer_data['beer_abv'] else "", 180, gc9a01.WHITE)
+        font = self.font()
+        self.center(font, beer_data['beer_name'] or "No beer", 50, gc9a01.WHITE)
+        self.center(font, f"{beer_data['beer_abv']}% ABV" if beer_data['beer_abv'] else "", 180, gc9a01.WHITE)
 
         # Display battery info if connected and provided
         if battery_info and battery_info['connected']:
             battery_text = f"Batt: {battery_info['percentage']}%"
-            self.center(noto_sans, battery_text, 200, gc9a01.YELLOW)
+            self.center(font, battery_text, 200, gc9a01.YELLOW)
 
-    def set_last_image(self, image_path):
-        """Set the last downloaded image path"""
-        self.last_image = image_path
\ No newline at end of file
+    def set_last_image(self, image_path, is_frame=False):
+        """Set the last downloaded image path, and whether it is a complete server-drawn frame"""
+        self.last_image = image_path
+        self.last_image_is_frame = is_frame
\ No newline at end of file
@@ -1,6 +1,8 @@
 # flow_sensor.py - Flow sensor management
+import asyncio
+import machine
 import time
-from machine import Pin, Timer
+from machine import Pin
 from config import FLOW_SENSOR_PIN, FLOW_DETECTION_THRESHOLD, FLOW_TIMEOUT
 
 class FlowSensor:
@@ -10,38 +12,49 @@ class FlowSensor:
         self.flow_count = 0
         self.flow_start_time = 0
         self.flow_active = False
-        self.timer_flow = Timer(0)
+        # Set from the interrupt handler when a pour starts, to wake run()
+        self.flow_started = asyncio.ThreadSafeFlag()
 
         # Setup flow sensor interrupt
         self.flow_pin.irq(trigger=Pin.IRQ_FALLING, handler=self.flow_callback)
 
     def flow_callback(self, p):
-        """Interrupt handler for flow sensor pulses"""
+        """Interrupt handler for flow sensor pulses; everything else happens in run()"""
         self.flow_count += 1
 
         # If flow wasn't active, mark it as started
         if not self.flow_active and self.flow_count >= FLOW_DETECTION_THRESHOLD:
             self.flow_active = True
             self.flow_start_time = time.ticks_ms()
-            print("Flow started")
-
-            # Start the timer to check for flow stop
-            self.timer_flow.init(period=FLOW_TIMEOUT, mode=Timer.PERIODIC, callback=self.check_flow_stop)
+            self.flow_started.set()
 
-    def check_flow_stop(self, t):
-        """Timer callback to check if flow has stopped"""
-        # Store the count and reset for next check
-        current_count = self.flow_count
+    def take_count(self):
+        """Pulses since the last call, read and reset without losing one to the interrupt"""
+        state = machine.disable_irq()
+        count = self.flow_count
         self.flow_count = 0
+        machine.enable_irq(state)
+        return count
+
+    async def run(self):
+        """Task: wait for each pour to start, then check every FLOW_TIMEOUT ms for it stopping"""
+        while True:
+            await self.flow_started.wait()
+            print("Flow started")
+
+            # Checks are timed from the start of the pour rather than from whenever
+            # this task last got to run, so a busy loop doesn't stretch the duration
+            check_time = self.flow_start_time
+            while True:
+                check_time = time.ticks_add(check_time, FLOW_TIMEOUT)
+                await asyncio.sleep_ms(max(0, time.ticks_diff(check_time, time.ticks_ms())))
+                if self.take_count() < FLOW_DETECTION_THRESHOLD:
+                    break
 
-        if self.flow_active and current_count < FLOW_DETECTION_THRESHOLD:
             # Flow has stopped
             self.flow_active = False
-            flow_duration = (time.ticks_ms() - self.flow_start_time) / 1000  # Convert to seconds
+            flow_duration = time.ticks_diff(check_time, self.flow_start_time) / 1000  # Convert to seconds
             print(f"Flow stopped after {flow_duration} seconds")
 
-            # Stop the timer
-            self.timer_flow.deinit()
-
-            # Report to server
-            self.api_client.report_pour_event("stop", flow_duration)
\ No newline at end of file
+            # Queue for the server; it's kept in flash until the server has it
+            self.api_client.report_pour(flow_duration)
@@ -0,0 +1,222 @@
+# http_client.py - Keep-alive HTTP/1.1 client for talking to the tap server
+
+import asyncio
+import json
+import socket
+
+# Unread bodies up to this many bytes are read and thrown away on close() to keep the connection
+DRAIN_LIMIT = 1024
+# Idle connections kept open; a long-poll holds one while the other tasks share the rest
+MAX_IDLE = 2
+
+class Response:
+    """A response whose body is read straight off the client's connection.
+
+    Read the body with json(), read() or readinto(), then close() the
+    response. A fully read body hands the connection back to the client
+    for another request; anything else closes it. These are all
+    coroutines: other tasks run while the server is slow to answer.
+    """
+
+    def __init__(self, client, conn, status_code, headers, method):
+        self.client = client
+        self.status_code = status_code
+        self.headers = headers  # lower-case names
+        self._conn = conn
+        self._chunked = headers.get('transfer-encoding', '').lower() == 'chunked'
+        self._keep_alive = headers.get('connection', '').lower() != 'close'
+        if method == 'HEAD' or status_code in (204, 304) or 100 <= status_code < 200:
+            self._remaining = 0
+        elif self._chunked:
+            self._remaining = None  # the first chunk's size is read with the body
+        elif 'content-length' in headers:
+            self._remaining = int(headers['content-length'])
+        else:
+            # No length: the body runs until the server closes the connection
+            self._remaining = -1
+            self._keep_alive = False
+
+    async def _next_chunk_size(self):
+        size = int((await self._conn.readline()).decode().split(';')[0], 16)
+        if size == 0:
+            # Skip any trailers up to the blank line that ends the body
+            while await self._conn.readline() not in (b'\r\n', b'\n', b''):
+                pass
+        return size
+
+    async def readinto(self, buf):
+        """Read body bytes into buf and return how many; 0 once the body is done"""
+        if self._remaining is None:
+            self._remaining = await self._next_chunk_size()
+        if self._remaining == 0:
+            return 0
+        if self._remaining > 0 and self._remaining < len(buf):
+            buf = memoryview(buf)[:self._remaining]
+        n = await self._conn.readinto(buf)
+        if not n:
+            if self._remaining > 0:
+                raise OSError("connection closed mid-body")
+            self._remaining = 0
+            return 0
+        if self._remaining > 0:
+            self._remaining -= n
+            if self._remaining == 0 and self._chunked:
+                await self._conn.readline()  # CRLF after the chunk
+                self._remaining = await self._next_chunk_size()
+        return n
+
+    async def read(self, size=-1):
+        """Read up to size body bytes, or the rest of the body"""
+        if size < 0:
+            parts = []
+            buf = bytearray(1024)
+            while True:
+                n = await self.readinto(buf)
+                if not n:
+                    return b''.join(parts)
+                parts.append(bytes(buf[:n]))
+        buf = bytearray(size)
+        return bytes(buf[:await self.readinto(buf)])
+
+    async def json(self):
+        return json.loads(await self.read())
+
+    async def close(self):
+        if self.client is None:
+            return
+        client, self.client = self.client, None
+        if self._keep_alive and not self._chunked and self._remaining is not None \
+                and 0 < self._remaining <= DRAIN_LIMIT:
+            # Skip a short unread body (a POST's reply, say) rather than lose the connection
+            try:
+                await self.read()
+            except (OSError, asyncio.TimeoutError):
+                pass
+        if self._remaining == 0 and self._keep_alive:
+            client._release(self._conn)
+        else:
+            self._conn.close()
+
+
+class Connection:
+    """One open connection to the server, every wait on it bounded by timeout"""
+
+    def __init__(self, reader, writer, timeout):
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+
+    async def write(self, data):
+        self.writer.write(data)
+        await asyncio.wait_for(self.writer.drain(), self.timeout)
+
+    async def readline(self):
+        return await asyncio.wait_for(self.reader.readline(), self.timeout)
+
+    async def readinto(self, buf):
+        return await asyncio.wait_for(self.reader.readinto(buf), self.timeout)
+
+    def close(self):
+        self.writer.close()
+
+
+class HTTPClient:
+    """Sends requests to one server over persistent connections.
+
+    The server's address is resolved once and reused. A request whose
+    reused connection turns out to have been closed by the server is sent
+    again on a fresh one, so callers never see idle keep-alive timeouts.
+    Each open response has a connection of its own, so several tasks can
+    have requests in flight at once; up to MAX_IDLE are kept for reuse.
+    """
+
+    def __init__(self, base_url, timeout=10):
+        scheme, _, host_port = base_url.rstrip('/').split('/', 2)
+        if scheme != 'http:':
+            raise ValueError("Only http:// URLs are supported")
+        host, _, port = host_port.partition(':')
+        self.host = host
+        self.port = int(port) if port else 80
+        self.timeout = timeout
+        self._host_header = host_port
+        self._ip = None
+        self._idle = []
+
+    async def _connect(self, timeout):
+        if self._ip is None:
+            # The one DNS lookup; open_connection() then gets an address it needn't resolve
+            self._ip = socket.getaddrinfo(self.host, self.port, 0, socket.SOCK_STREAM)[0][-1][0]
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(self._ip, self.port), timeout)
+        except (OSError, asyncio.TimeoutError):
+            # The server may have moved (new DHCP lease); resolve again next time
+            self._ip = None
+            raise
+        return Connection(reader, writer, timeout)
+
+    async def request(self, method, path, body=None, headers=None, timeout=None):
+        """Send a request for path (which starts with /) and return its Response"""
+        if isinstance(body, str):
+            body = body.encode()
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self._host_header}\r\n"
+        if body is not None:
+            head += f"Content-Length: {len(body)}\r\n"
+        if headers:
+            for name, value in headers.items():
+                head += f"{name}: {value}\r\n"
+        head = (head + "\r\n").encode()
+        timeout = timeout or self.timeout
+
+        while True:
+            reused = bool(self._idle)
+            conn = self._idle.pop() if reused else await self._connect(timeout)
+            conn.timeout = timeout
+            try:
+                await conn.write(head + body if body else head)
+                status_line = await conn.readline()
+                if not status_line:
+                    raise OSError("connection closed")
+            except asyncio.TimeoutError:
+                # Not retried: the server may still be working on it
+                conn.close()
+                raise
+            except OSError:
+                conn.close()
+                if reused:
+                    # Most likely the server closed our idle connection; try a new one
+                    continue
+                raise
+            break
+
+        try:
+            status_code = int(status_line.decode().split(None, 2)[1])
+            headers = {}
+            while True:
+                line = await conn.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode().partition(':')
+                headers[name.strip().lower()] = value.strip()
+            return Response(self, conn, status_code, headers, method)
+        except BaseException:
+            # Including cancellation: the connection is mid-response and can't be reused
+            conn.close()
+            raise
+
+    async def get(self, path, headers=None, timeout=None):
+        return await self.request('GET', path, headers=headers, timeout=timeout)
+
+    async def post(self, path, body=None, headers=None, timeout=None):
+        return await self.request('POST', path, body, headers, timeout)
+
+    def _release(self, conn):
+        # The response was read to the end; keep the connection for a later request
+        if len(self._idle) < MAX_IDLE:
+            self._idle.append(conn)
+        else:
+            conn.close()
+
+    def close(self):
+        """Close the idle connections"""
+        while self._idle:
+            self._idle.pop().close()
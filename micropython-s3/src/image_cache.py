@@ -0,0 +1,127 @@
+# image_cache.py - Content-addressed cache of downloaded images in flash
+
+import json
+import os
+
+INDEX_NAME = "index.json"
+
+class ImageCache:
+    """Downloaded images kept in flash by content hash, least recently used evicted first.
+
+    Each image is stored once as <directory>/<sha1>.<ext>, whichever tap or
+    beer it came for, so going back to an earlier beer costs no download.
+    A small JSON index holds each file's size and when it was last used.
+    "When" is a counter rather than the time, which is often unset at boot.
+    Uses are counted in RAM and only written out when an image is added or
+    evicted, so a reboot forgets the recent ones; flash writes are what cost.
+
+    The cache may grow until only `reserve` bytes of the filesystem are
+    left free (os.statvfs), so its budget is whatever else on flash leaves
+    it. The image last handed out by get() or add() is never evicted: it's
+    the one on screen.
+
+    The directory belongs to the cache: files in it that the index doesn't
+    list are deleted when the cache loads.
+    """
+
+    def __init__(self, directory, reserve):
+        self.dir = directory
+        self.reserve = reserve
+        self.index_path = f"{directory}/{INDEX_NAME}"
+        self.current = None
+        try:
+            os.mkdir(directory)
+        except OSError:
+            pass  # Directory already exists
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+            self.clock = index['clock']
+            # hash -> [file name, size, clock when last used]
+            self.files = index['files']
+            changed = False
+        except (OSError, ValueError, KeyError):
+            self.clock = 0
+            self.files = {}
+            changed = True
+
+        # Forget entries whose file is gone or the wrong size, and delete files the index
+        # doesn't know, such as temp files of interrupted downloads
+        known = set()
+        for sha1, (name, size, used) in list(self.files.items()):
+            try:
+                intact = os.stat(f"{self.dir}/{name}")[6] == size
+            except OSError:
+                intact = False
+            if intact:
+                known.add(name)
+            else:
+                del self.files[sha1]
+                changed = True
+        for name in os.listdir(self.dir):
+            if name != INDEX_NAME and name not in known:
+                self._remove(name)
+        if changed:
+            self._save()
+
+    def _save(self):
+        # Replaced by a rename, so a power cut leaves either the old index or the new
+        with open(self.index_path + ".tmp", "w") as f:
+            json.dump({'clock': self.clock, 'files': self.files}, f)
+        os.rename(self.index_path + ".tmp", self.index_path)
+
+    def _remove(self, name):
+        try:
+            os.remove(f"{self.dir}/{name}")
+        except OSError:
+            pass
+
+    def _use(self, sha1):
+        # Only in RAM: saved with the next add or eviction, not on every hit, to spare the flash
+        self.clock += 1
+        self.files[sha1][2] = self.clock
+        self.current = sha1
+
+    def get(self, sha1):
+        """Path of the cached image with this hash, marked as just used, or None"""
+        entry = self.files.get(sha1)
+        if not entry:
+            return None
+        self._use(sha1)
+        return f"{self.dir}/{entry[0]}"
+
+    def new_path(self, sha1, ext):
+        """Where to download the image with this hash before add()ing it"""
+        return f"{self.dir}/{sha1}.{ext}"
+
+    def add(self, sha1, path, size):
+        """Record a downloaded image that is now at new_path(sha1, ext)"""
+        self.files[sha1] = [path.rsplit('/', 1)[1], size, 0]
+        self._use(sha1)
+        self._save()
+
+    def free_bytes(self):
+        stat = os.statvfs(self.dir)
+        return stat[0] * stat[3]  # block size * free blocks
+
+    def make_room(self, size):
+        """Evict least recently used images until size bytes fit above the reserve.
+
+        Returns False if even evicting everything but the current image
+        isn't enough.
+        """
+        evicted = False
+        while self.free_bytes() - size < self.reserve:
+            candidates = [sha1 for sha1 in self.files if sha1 != self.current]
+            if not candidates:
+                break
+            oldest = min(candidates, key=lambda sha1: self.files[sha1][2])
+            print(f"Image cache full, evicting {oldest}")
+            self._remove(self.files.pop(oldest)[0])
+            evicted = True
+        if evicted:
+            self._save()
+        return self.free_bytes() - size >= self.reserve
@@ -1,13 +1,15 @@
 # led_controller.py - LED control functionality
+import asyncio
 import neopixel
-from machine import Pin, Timer
+from machine import Pin
 from config import STATUS_LED_PIN, LED_COUNT, STATUS_RED, STATUS_YELLOW, STATUS_GREEN
 from config import KEG_FULL, KEG_MEDIUM, KEG_LOW, KEG_EMPTY
 
 class LEDController:
     def __init__(self):
         self.status_leds = neopixel.NeoPixel(Pin(STATUS_LED_PIN), LED_COUNT)
-        self.connection_blink_timer = None
+        # Battery monitor whose level run() blinks while connecting, None when not connecting
+        self._battery_monitor = None
         self.connection_blink_state = False
 
     def set_status_led(self, color):
@@ -71,43 +73,30 @@ class LEDController:
 
         self.status_leds.write()
 
-    def connection_blink_callback(self, timer):
-        """Timer callback to handle blinking during connection"""
-        self.connection_blink_state = not self.connection_blink_state
-
-        print("connection_blink_callback")
-
-        # Get current battery status and update LEDs
-        # Note: We need to pass the battery monitor to get current status
-        if hasattr(self, '_battery_monitor'):
-            battery_info = self._battery_monitor.get_battery_status()
-            self.set_battery_level_leds_connecting(battery_info['percentage'])
+    async def run(self):
+        """Task: blink the connection battery display every 500ms while it's on"""
+        while True:
+            await asyncio.sleep_ms(500)
+            if self._battery_monitor:
+                self.connection_blink_state = not self.connection_blink_state
+                battery_info = self._battery_monitor.get_battery_status()
+                self.set_battery_level_leds_connecting(battery_info['percentage'])
 
     def start_connection_battery_display(self, battery_monitor):
-        """Start the battery level display during connection"""
+        """Start the battery level display during connection; run() animates it"""
         print("start_connection_battery_display")
 
-        # Store reference to battery monitor for callback
+        # run() blinks the display for as long as this is set
         self._battery_monitor = battery_monitor
 
         # Initialize battery display
         battery_info = battery_monitor.get_battery_status()
         self.set_battery_level_leds_connecting(battery_info['percentage'])
 
-        # Start blinking timer (blink every 500ms)
-        self.connection_blink_timer = Timer(1)
-        self.connection_blink_timer.init(period=500, mode=Timer.PERIODIC, callback=self.connection_blink_callback)
-
     def stop_connection_battery_display(self):
-        """Stop the battery level display and clean up timer"""
+        """Stop the battery level display"""
         print("stop_connection_battery_display")
 
-        if self.connection_blink_timer:
-            self.connection_blink_timer.deinit()
-            self.connection_blink_timer = None
-        else:
-            print("stop_connection_battery_display NO TIMER TO STOP")
-
-        # Clear battery monitor reference
-        if hasattr(self, '_battery_monitor'):
-            delattr(self, '_battery_monitor')
\ No newline at end of file
+        if not self._battery_monitor:
+            print("stop_connection_battery_display NOT STARTED")
+        self._battery_monitor = None
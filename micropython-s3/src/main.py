@@ -1,7 +1,7 @@
 # main.py - Main entry point for ESP32 Keg Tap Monitor
+import asyncio
 import gc
-import time
-from machine import Pin, Timer, freq
+from machine import Pin, freq
 from config import *
 from wifi_manager import WiFiManager
 from display_manager import DisplayManager
@@ -49,7 +49,31 @@ def initialize_hardware():
 
     return True
 
-def main():
+async def tap_updates():
+    """Task: keep the tap info current for as long as the device runs"""
+    refresh_interval = 60  # seconds between refreshes
+
+    while True:
+        if USE_PUSH_UPDATES:
+            # Wait until the server reports a change to our tap; the
+            # other tasks keep running while the request is open
+            ok = await api_client.wait_for_tap_change() is not None
+        else:
+            await asyncio.sleep(refresh_interval)
+            print("Refreshing tap info...")
+            ok, _ = await api_client.fetch_tap_info()
+
+        if not ok:
+            # Server unreachable, don't hammer it
+            await asyncio.sleep(5)
+
+async def collect_garbage():
+    """Task: run garbage collection to free memory"""
+    while True:
+        await asyncio.sleep(1)
+        gc.collect()
+
+async def main():
     """Main function to initialize and run the system"""
     gc.enable()
     gc.collect()
@@ -59,15 +83,28 @@ def main():
         print("Failed to initialize hardware")
         return
 
+    # Everything below runs as tasks that take turns, so a slow server never
+    # holds up pour detection or the LEDs. Pours are detected and queued in
+    # flash from here on, even before Wi-Fi is up.
+    asyncio.create_task(led_controller.run())
+    asyncio.create_task(battery_monitor.run())
+    asyncio.create_task(flow_sensor.run())
+    asyncio.create_task(collect_garbage())
+
+    # Draw the tap as it was before the reboot, if its image is still in flash;
+    # Wi-Fi then connects without covering it up
+    shown = api_client.show_cached_tap_info()
+
     # Start battery display during connection
     led_controller.start_connection_battery_display(battery_monitor)
 
     # Connect to WiFi
-    if not wifi_manager.connect():
+    if not await wifi_manager.connect(quiet=shown):
         print("Failed to connect to WiFi, retrying in 5 seconds")
-        time.sleep(5)
-        if not wifi_manager.connect():
+        await asyncio.sleep(5)
+        if not await wifi_manager.connect(quiet=shown):
             print("Failed to connect to WiFi again, can't continue")
+            led_controller.stop_connection_battery_display()
             display_manager.display_message("WiFi Failed!", 100)
             led_controller.set_status_led(STATUS_RED)
             return
@@ -75,31 +112,20 @@ def main():
     # Stop battery display
     led_controller.stop_connection_battery_display()
 
+    # Upload any pours left over from before a reboot or Wi-Fi drop, and each new one
+    asyncio.create_task(api_client.upload_pours())
+
     # Initial fetch of tap info
-    if not api_client.fetch_tap_info():
-        print("Failed to fetch tap info, can't continue")
+    ok, _ = await api_client.fetch_tap_info()
+    if not ok:
+        print("Failed to fetch tap info, retrying")
         led_controller.set_status_led(STATUS_YELLOW)
-        return
-
-    # Main loop
-    refresh_interval = 60  # seconds between refreshes
-    last_refresh = time.time()
-
-    while True:
-        # Periodically refresh tap info
-        current_time = time.time()
-        if current_time - last_refresh >= refresh_interval:
-            print("Refreshing tap info...")
-            api_client.fetch_tap_info()
-            last_refresh = current_time
 
-        # Give some time to other tasks
-        time.sleep(1)
-        gc.collect()  # Run garbage collection to free memory
+    await tap_updates()
 
 if __name__ == "__main__":
     try:
-        main()
+        asyncio.run(main())
     except Exception as e:
         print("Fatal error:", e)
         if display_manager:
@@ -0,0 +1,115 @@
+# pour_queue.py - Flash-backed queue of pours waiting to reach the server
+
+import binascii
+import os
+import struct
+
+# seq, timestamp (device clock seconds, 0 if unknown), duration in ms, CRC-32 of the first three
+RECORD = "<IIII"
+RECORD_SIZE = struct.calcsize(RECORD)
+# queue id, highest seq the server has acknowledged
+STATE = "<II"
+
+class PourQueue:
+    """Pours that have stopped but that the server hasn't acknowledged yet.
+
+    Records are fixed-size and live in a ring file of `slots` slots, seq
+    going in slot seq % slots. The file is created at full size, so it never
+    grows and a pour rewrites only its own record. A second small file keeps
+    the highest seq the server has acknowledged, written once per uploaded
+    batch rather than once per pour. Both survive reboots, and a record torn
+    by a power cut fails its CRC and is skipped.
+
+    Once more than `slots` pours are waiting, each new one overwrites the
+    oldest.
+    """
+
+    def __init__(self, path, slots=256):
+        self.path = path
+        self.state_path = path + ".ack"
+        self.slots = slots
+        self._load()
+
+    def _load(self):
+        data = b""
+        try:
+            with open(self.state_path, "rb") as f:
+                self.queue_id, self.acked = struct.unpack(STATE, f.read())
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except (OSError, ValueError):
+            # A new queue gets a new id, so its seqs can't collide with an old one's
+            # on the server. Any records left without their state start over with it.
+            self.queue_id = struct.unpack("<I", os.urandom(4))[0]
+            self.acked = 0
+            self._save_state()
+        if len(data) != self.slots * RECORD_SIZE:
+            data = bytes(self.slots * RECORD_SIZE)
+            with open(self.path, "wb") as f:
+                f.write(data)
+
+        newest = self.acked
+        for slot in range(self.slots):
+            record = self._unpack(data, slot * RECORD_SIZE)
+            if record and record[0] > newest:
+                newest = record[0]
+        self.next_seq = newest + 1
+        # Oldest seq that may still be waiting
+        self.first = max(self.acked + 1, self.next_seq - self.slots)
+
+    def _save_state(self):
+        # Replaced by a rename, so a power cut leaves either the old state or the new
+        with open(self.state_path + ".tmp", "wb") as f:
+            f.write(struct.pack(STATE, self.queue_id, self.acked))
+        os.rename(self.state_path + ".tmp", self.state_path)
+
+    def _unpack(self, data, offset):
+        seq, timestamp, duration_ms, crc = struct.unpack_from(RECORD, data, offset)
+        if seq == 0 or crc != binascii.crc32(data[offset:offset + RECORD_SIZE - 4]):
+            return None
+        return seq, timestamp, duration_ms
+
+    def __len__(self):
+        return self.next_seq - self.first
+
+    def append(self, timestamp, duration_ms):
+        """Write a pour to flash and return its seq"""
+        seq = self.next_seq
+        record = struct.pack("<III", seq, timestamp, duration_ms)
+        record += struct.pack("<I", binascii.crc32(record))
+        with open(self.path, "r+b") as f:
+            f.seek((seq % self.slots) * RECORD_SIZE)
+            f.write(record)
+        self.next_seq += 1
+        if self.next_seq - self.first > self.slots:
+            print(f"Pour queue full, dropped pour {self.first}")
+            self.first = self.next_seq - self.slots
+        return seq
+
+    def peek(self, limit):
+        """The oldest waiting pours, up to limit.
+
+        Returns a list of (seq, timestamp, duration_ms) and the last seq it
+        covers, which is what to ack() once the server has the list: torn
+        records are left out, so the list can be shorter than the range.
+        """
+        records = []
+        count = min(limit, len(self))
+        if not count:
+            return records, self.first - 1
+        with open(self.path, "rb") as f:
+            for seq in range(self.first, self.first + count):
+                f.seek((seq % self.slots) * RECORD_SIZE)
+                record = self._unpack(f.read(RECORD_SIZE), 0)
+                # A slot holding some other seq was torn or never written; skip it
+                if record and record[0] == seq:
+                    records.append(record)
+        return records, self.first + count - 1
+
+    def ack(self, seq):
+        """Drop every pour up to and including seq, once the server has it"""
+        if seq < self.first:
+            return
+        self.acked = seq
+        self.first = seq + 1
+        self._save_state()
@@ -1,6 +1,6 @@
 # wifi_manager.py - WiFi connection management
+import asyncio
 import network
-import time
 from config import WIFI_SSID, WIFI_PASSWORD
 
 class WiFiManager:
@@ -8,9 +8,13 @@ class WiFiManager:
         self.display_manager = display_manager
         self.wlan = network.WLAN(network.STA_IF)
 
-    def connect(self):
-        """Connect to WiFi network"""
-        self.display_manager.display_message("Connecting to WiFi...")
+    async def connect(self, quiet=False):
+        """Connect to WiFi network, letting other tasks run while it waits.
+
+        With quiet set, progress isn't shown on the screen, which is left as it is.
+        """
+        if not quiet:
+            self.display_manager.display_message("Connecting to WiFi...")
 
         self.wlan.active(True)
 
@@ -25,19 +29,21 @@ class WiFiManager:
                     break
                 max_wait -= 1
                 print("Waiting for connection...")
-                time.sleep(1)
+                await asyncio.sleep(1)
 
             if self.wlan.isconnected():
                 print("Connected to WiFi")
                 ip = self.wlan.ifconfig()[0]
                 print(f"IP: {ip}")
-                self.display_manager.display_message(f"Connected: {ip}", 100)
-                time.sleep(2)
+                if not quiet:
+                    self.display_manager.display_message(f"Connected: {ip}", 100)
+                    await asyncio.sleep(2)
                 return True
             else:
                 print("Failed to connect to WiFi")
-                self.display_manager.display_message("WiFi Failed!", 100)
-                time.sleep(2)
+                if not quiet:
+                    self.display_manager.display_message("WiFi Failed!", 100)
+                    await asyncio.sleep(2)
                 return False
         else:
             print("Already connected to WiFi")
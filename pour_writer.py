@@ -0,0 +1,121 @@
+# pour_writer.py - Group-commit write queue for pour ingestion
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class PourWriter:
+    """Applies pours on a single writer thread and commits them in groups.
+
+    Request threads queue a pour and block on the returned Future, so they
+    still answer with the new volume, but a burst of pours shares one commit
+    (one fsync on the SD card) instead of each paying for its own. A group is
+    flushed once max_batch pours are waiting or flush_interval_ms has passed
+    since the first of them arrived. A request that gives up waiting can
+    cancel() its Future, which succeeds only while the pour is still queued.
+    """
+
+    def __init__(self, connect, apply, flush_interval_ms=20, max_batch=100):
+        self.connect = connect  # returns the writer thread's connection
+        self.apply = apply      # apply(conn, tap_id, duration, source, device_ts)
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch = max_batch
+        self.commits = 0
+        self.pours = 0
+        self._reset()
+        # The writer thread doesn't survive a fork, so pre-forked workers
+        # start their own on first use
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, tap_id, duration, source, device_ts=None):
+        """Queue a pour, returning a Future that resolves to apply()'s result"""
+        future = Future()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='pour-writer', daemon=True)
+                self._thread.start()
+            self._queue.put((future, (tap_id, duration, source, device_ts)))
+        return future
+
+    def close(self):
+        """Flush every queued pour and stop the writer thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is None:
+                return
+            self._queue.put(None)
+        thread.join()
+
+    def _run(self):
+        running = True
+        while running:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    # Shutting down: flush what we have, nothing queues after the sentinel
+                    running = False
+                    break
+                batch.append(item)
+
+            self._flush(batch)
+
+    def _flush(self, batch):
+        # Drop pours whose request gave up waiting and cancelled them; the
+        # rest can no longer be cancelled, so their requests know they'll land
+        batch = [(future, args) for future, args in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        # Each pour gets its own savepoint inside the group's transaction, so
+        # one that fails is rolled back and reported alone while the rest commit
+        outcomes = []
+        conn = None
+        try:
+            conn = self.connect()
+            conn.execute('BEGIN')
+            for future, args in batch:
+                conn.execute('SAVEPOINT pour')
+                try:
+                    outcomes.append((future, self.apply(conn, *args), None))
+                except Exception as e:
+                    conn.execute('ROLLBACK TO pour')
+                    outcomes.append((future, None, e))
+                conn.execute('RELEASE pour')
+            conn.commit()
+        except Exception as e:
+            # No connection, or the group itself couldn't commit: nothing was stored
+            try:
+                if conn is not None and conn.in_transaction:
+                    conn.rollback()
+            except Exception:
+                pass  # the writer thread has to outlive a broken connection
+            for future, _ in batch:
+                future.set_exception(e)
+            return
+
+        self.commits += 1
+        self.pours += sum(1 for _, _, error in outcomes if error is None)
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
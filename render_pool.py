@@ -0,0 +1,94 @@
+# render_pool.py - Renders image variants on a pool of worker processes
+import functools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from image_utils import IMAGE_FORMATS, render_variant
+from metrics import PILLOW_SECONDS, RENDER_SECONDS
+
+
+class RenderPool:
+    """Resizes images off the request path and stores the results in an ImageCache.
+
+    Decoding a phone-camera upload and resizing it with LANCZOS costs
+    hundreds of milliseconds of CPU and a large transient allocation, so it
+    is kept out of the request threads. Renders go to a small process pool,
+    which also caps how many run at once, and concurrent requests for the
+    same variant share one render. The pool is started on first use, and
+    again in a forked child, since executor threads don't survive a fork.
+    """
+
+    def __init__(self, cache, max_workers=2):
+        self.cache = cache
+        self.max_workers = max_workers
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = {}  # cache key -> Future of the cached path
+
+    def render(self, source_path, width, height, quality, fmt='jpeg'):
+        """Return a Future of the cached path of source_path rendered at width x height in fmt"""
+        key = self.cache.key_for(source_path, width, height, quality, ext=IMAGE_FORMATS[fmt][0])
+        return self.run(key, render_variant, fmt, source_path, width, height, quality)
+
+    def run(self, key, render, *args):
+        """Return a Future of the cached path for key, running render(*args) on the pool on a miss.
+
+        render must be a module-level function returning the entry's bytes and a
+        sequence of (op, seconds) timings, which are recorded here: metrics
+        observed in a render process would never reach /metrics.
+        """
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+            path = self.cache.get(key)
+            future = Future()
+            if path is not None:
+                future.set_result(path)
+                return future
+
+            try:
+                job = self._pool().submit(render, *args)
+            except BrokenProcessPool:
+                # A render process died (killed for memory, say); start a fresh pool
+                self._executor = None
+                job = self._pool().submit(render, *args)
+            self._pending[key] = future
+        job.add_done_callback(functools.partial(self._store, key, future, time.perf_counter()))
+        return future
+
+    def _pool(self):
+        if self._executor is None:
+            # spawn, not fork: the server process is multi-threaded
+            self._executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def _store(self, key, future, queued_at, job):
+        try:
+            data, timings = job.result()
+            path = self.cache.put(key, data)
+        except BaseException as e:
+            with self._lock:
+                self._pending.pop(key, None)
+            future.set_exception(e)
+            return
+        RENDER_SECONDS.observe(time.perf_counter() - queued_at)
+        for op, seconds in timings:
+            PILLOW_SECONDS.observe(seconds, op)
+        with self._lock:
+            self._pending.pop(key, None)
+        future.set_result(path)
+
+    def close(self):
+        """Wait for queued renders and stop the worker processes"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -9,6 +9,8 @@ CREATE TABLE IF NOT EXISTS beers (
 );
 
 -- Create taps table
+-- version is a fleet-wide change counter: every write to a tap stamps it
+-- with MAX(version) + 1, and updated_at holds the unix time of that write
 CREATE TABLE IF NOT EXISTS taps (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     tap_id TEXT NOT NULL,
@@ -16,15 +18,44 @@ CREATE TABLE IF NOT EXISTS taps (
     volume REAL NOT NULL,
     full_volume REAL NOT NULL,
     flow_rate REAL NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    updated_at INTEGER NOT NULL DEFAULT 0,
     FOREIGN KEY (beer_id) REFERENCES beers (id)
 );
 
--- Insert some sample data
-INSERT INTO beers (name, abv, image_path) VALUES
-                                              ('IPA', 6.5, 'beer_images/default.jpg'),
-                                              ('Stout', 5.0, 'beer_images/default.jpg'),
-                                              ('Pilsner', 4.2, 'beer_images/default.jpg');
+-- Each pour looks its tap up by tap_id, which must be unique per device
+CREATE UNIQUE INDEX IF NOT EXISTS idx_taps_tap_id ON taps (tap_id);
+CREATE INDEX IF NOT EXISTS idx_taps_version ON taps (version);
 
-INSERT INTO taps (tap_id, beer_id, volume, full_volume, flow_rate) VALUES
-                                                          ('tap_1', 1, 5000, 5000, 15.0),  -- 5 liters of IPA, flowing at 15ml/sec
-                                                          ('tap_2', 2, 5000, 5000, 12.0);  -- 5 liters of Stout, flowing at 12ml/sec
+-- Create pours table
+-- One row per pour reported by a device, kept as consumption history.
+-- device_ts is the unix time the device reported for the pour, if any, and
+-- volume is the mL poured at the tap's flow rate at the time. event_id is the
+-- device's own id for the pour, so a retried upload can't apply it twice.
+CREATE TABLE IF NOT EXISTS pours (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tap_id TEXT NOT NULL,
+    event_id TEXT,
+    device_ts REAL,
+    duration REAL NOT NULL,
+    volume REAL NOT NULL,
+    source TEXT NOT NULL,
+    created_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+);
+
+CREATE INDEX IF NOT EXISTS idx_pours_tap_id ON pours (tap_id, created_at);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_pours_event_id ON pours (tap_id, event_id);
+
+-- Create image_jobs table
+-- Background pre-rendering of an uploaded beer image's display and thumbnail
+-- variants, one row per image. status is rendering, done or failed, and
+-- rendered counts the variants finished so far out of variants.
+CREATE TABLE IF NOT EXISTS image_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    image_path TEXT NOT NULL UNIQUE,
+    status TEXT NOT NULL,
+    variants INTEGER NOT NULL,
+    rendered INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+);
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# bench_group_commit.py - Compare pour throughput with and without group commit
+#
+# Usage: python scripts/bench_group_commit.py [--pours 2000] [--threads 32] [--db-dir DIR]
+#
+# Point --db-dir at the SD card on the Pi to see the real cost of a commit;
+# the default temp directory is often tmpfs, where fsync is nearly free.
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import app as tap_app
+
+
+def run(args, group_commit):
+    with tempfile.TemporaryDirectory(dir=args.db_dir) as tmp:
+        tap_app.app.config['DATABASE'] = os.path.join(tmp, 'bench.db')
+        tap_app.app.config['POUR_GROUP_COMMIT'] = group_commit
+        tap_app.init_db()
+        commits_before = tap_app.pour_writer.commits
+
+        def pour(i):
+            client = tap_app.app.test_client()
+            response = client.post(f'/api/tap/tap_{i % 2 + 1}/pour_event',
+                                   json={'event_type': 'stop', 'duration': 0.01})
+            return response.status_code
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            statuses = list(pool.map(pour, range(args.pours)))
+        elapsed = time.perf_counter() - start
+
+        commits = tap_app.pour_writer.commits - commits_before if group_commit else args.pours
+        return {
+            'group_commit': group_commit,
+            'pours': args.pours,
+            'errors': sum(1 for status in statuses if status != 200),
+            'seconds': round(elapsed, 3),
+            'pours_per_second': round(args.pours / elapsed, 1),
+            'commits': commits,
+            'commits_per_second': round(commits / elapsed, 1),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare pour throughput with and without group commit')
+    parser.add_argument('--pours', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--db-dir', default=None, help='directory for the benchmark database')
+    args = parser.parse_args()
+
+    results = [run(args, group_commit=False), run(args, group_commit=True)]
+    tap_app.pour_writer.close()
+
+    print(f"{'mode':<14}{'pours/s':>10}{'commits':>10}{'commits/s':>12}{'errors':>8}")
+    for result in results:
+        mode = 'group commit' if result['group_commit'] else 'per request'
+        print(f"{mode:<14}{result['pours_per_second']:>10}{result['commits']:>10}"
+              f"{result['commits_per_second']:>12}{result['errors']:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# bench_resize.py - Time and peak memory of resizing uploads for the tap displays
+#
+# Usage:
+#   python scripts/bench_resize.py
+#   python scripts/bench_resize.py --corpus ~/photos --size 240x240 --output resize.json
+#
+# Without --corpus, writes a set of synthetic photos from VGA up to 48MP to
+# a scratch directory. Each image is resized by the full-decode path the
+# server used to take (decode everything, then LANCZOS) and by
+# image_utils.resize_to_fill (JPEG draft mode, reduce(), then LANCZOS). Every
+# run happens in a fresh process so its peak RSS belongs to that one resize
+# (read from /proc, so Linux only).
+import argparse
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'scripts'))
+sys.path.insert(0, ROOT)
+
+from loadgen import git_commit  # noqa: E402
+
+SYNTHETIC_SIZES = [(640, 480), (1920, 1080), (3024, 4032), (4032, 3024), (8064, 6048)]
+
+
+def legacy_resize(img, width, height):
+    """The resize the server did before draft mode: full decode, then LANCZOS"""
+    from PIL import Image
+    if img.mode in ("RGBA", "P"):
+        img = img.convert("RGB")
+    src_ratio = img.width / img.height
+    if width / height > src_ratio:
+        scale_height = int(width / src_ratio)
+        img = img.resize((width, scale_height), Image.LANCZOS)
+        top = (scale_height - height) // 2
+        return img.crop((0, top, width, top + height))
+    scale_width = int(height * src_ratio)
+    img = img.resize((scale_width, height), Image.LANCZOS)
+    left = (scale_width - width) // 2
+    return img.crop((left, 0, left + width, height))
+
+
+def peak_rss_kb():
+    # VmHWM, not ru_maxrss: that keeps the high-water mark of the parent that forked us
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])
+    raise RuntimeError('no VmHWM in /proc/self/status')
+
+
+def run_one(path, method, width, height):
+    """Resize one image in this process and print its timing and memory as JSON"""
+    from PIL import Image
+    from image_utils import resize_to_fill
+    Image.MAX_IMAGE_PIXELS = None  # the legacy path had no cap; measure it anyway
+    resize = resize_to_fill if method == 'new' else legacy_resize
+    baseline = peak_rss_kb()
+    start = time.perf_counter()
+    with Image.open(path) as img:
+        resize(img, width, height).tobytes()
+    seconds = time.perf_counter() - start
+    peak = peak_rss_kb()
+    print(json.dumps({'seconds': seconds, 'peak_rss_mb': peak / 1024, 'growth_mb': (peak - baseline) / 1024}))
+
+
+def make_corpus(directory):
+    """Write synthetic photos of SYNTHETIC_SIZES; smooth gradients plus noise, like a real photo"""
+    from PIL import Image
+    paths = []
+    for width, height in SYNTHETIC_SIZES:
+        gradient = Image.merge('RGB', (Image.linear_gradient('L').resize((width, height)),
+                                       Image.radial_gradient('L').resize((width, height)),
+                                       Image.effect_noise((width, height), 40)))
+        path = os.path.join(directory, f'photo_{width}x{height}.jpg')
+        gradient.save(path, quality=90)
+        paths.append(path)
+    png = os.path.join(directory, 'label_2000x2000.png')
+    Image.radial_gradient('L').resize((2000, 2000)).convert('RGBA').save(png)
+    paths.append(png)
+    return paths
+
+
+def measure(path, method, width, height, repeat):
+    """Best time and worst peak RSS over repeat fresh processes"""
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, __file__, '--one', method, path, '--size', f'{width}x{height}'],
+                             check=True, capture_output=True, text=True).stdout
+        runs.append(json.loads(out))
+    return {'seconds': min(r['seconds'] for r in runs),
+            'peak_rss_mb': max(r['peak_rss_mb'] for r in runs),
+            'growth_mb': max(r['growth_mb'] for r in runs)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark resizing uploads for the tap displays')
+    parser.add_argument('--corpus', help='directory of sample images (default: generate synthetic ones)')
+    parser.add_argument('--size', default='240x240', help='target size, WIDTHxHEIGHT')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per image and path')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--one', nargs=2, metavar=('METHOD', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    width, height = (int(v) for v in args.size.split('x'))
+
+    if args.one:
+        run_one(args.one[1], args.one[0], width, height)
+        return
+
+    from PIL import Image
+    scratch = None
+    if args.corpus:
+        paths = sorted(p for p in glob.glob(os.path.join(args.corpus, '*')) if os.path.isfile(p))
+    else:
+        scratch = tempfile.mkdtemp(prefix='bench-resize-')
+        paths = make_corpus(scratch)
+
+    results = []
+    try:
+        print(f"{'image':<28}{'pixels':>12}{'old s':>9}{'new s':>9}{'old MB':>9}{'new MB':>9}")
+        for path in paths:
+            with Image.open(path) as img:
+                pixels = img.width * img.height
+            old = measure(path, 'old', width, height, args.repeat)
+            new = measure(path, 'new', width, height, args.repeat)
+            results.append({'image': os.path.basename(path), 'pixels': pixels, 'old': old, 'new': new})
+            print(f"{os.path.basename(path)[:27]:<28}{pixels:>12}{old['seconds']:>9.3f}{new['seconds']:>9.3f}"
+                  f"{old['growth_mb']:>9.1f}{new['growth_mb']:>9.1f}")
+    finally:
+        if scratch:
+            shutil.rmtree(scratch, ignore_errors=True)
+    print('MB is peak RSS growth over the process after importing Pillow')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'commit': git_commit(), 'size': [width, height], 'results': results}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# bench_serving.py - Compare the Flask dev server with the gunicorn setup under device load
+#
+# Usage:
+#   python scripts/bench_serving.py --clients 50 --duration 30
+#   python scripts/bench_serving.py --workers 2 --threads 16 --output serving.json
+#
+# Seeds a scratch directory with one tap per client, starts each server on a
+# free local port, runs loadgen.py --url against it and prints the totals side
+# by side. The dev server runs the way start.sh used to (app.run, threaded,
+# minus the debugger and reloader); gunicorn runs with gunicorn.conf.py.
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'scripts'))
+
+from loadgen import git_commit, seed_workdir  # noqa: E402
+
+DEV_SERVER = "import app; app.app.run(host='127.0.0.1', port={port}, threaded=True)"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(port, proc, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'server exited with status {proc.returncode}')
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/api/stats')
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('server did not start in time')
+
+
+def run_server(name, command, port, workdir, env, args):
+    """Start one server, drive it with loadgen and return the loadgen summary"""
+    log = open(os.path.join(workdir, f'{name}.log'), 'w')
+    proc = subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        wait_until_up(port, proc)
+        result_file = os.path.join(workdir, f'{name}.json')
+        subprocess.run([sys.executable, os.path.join(ROOT, 'scripts', 'loadgen.py'),
+                        '--url', f'http://127.0.0.1:{port}', '--clients', str(args.clients),
+                        '--duration', str(args.duration), '--think', str(args.think),
+                        '--output', result_file], check=True)
+        with open(result_file) as f:
+            return json.load(f)['summary']
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=70)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        log.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the dev server with gunicorn under device load')
+    parser.add_argument('--clients', type=int, default=20, help='number of virtual devices')
+    parser.add_argument('--duration', type=float, default=20, help='seconds to run against each server')
+    parser.add_argument('--think', type=float, default=0.05,
+                        help='max random pause between a device\'s requests, in seconds')
+    parser.add_argument('--workers', type=int, help='gunicorn worker processes (TAP_WORKERS)')
+    parser.add_argument('--threads', type=int, help='threads per gunicorn worker (TAP_THREADS)')
+    parser.add_argument('--output', help='write both summaries to this JSON file')
+    args = parser.parse_args()
+
+    results = {}
+    for name in ('dev', 'gunicorn'):
+        # A fresh database per server so both start from the same state
+        workdir = tempfile.mkdtemp(prefix=f'bench-{name}-')
+        try:
+            seed_workdir(workdir, args.clients)
+            env = dict(os.environ, PYTHONPATH=ROOT)
+            port = free_port()
+            if name == 'dev':
+                command = [sys.executable, '-c', DEV_SERVER.format(port=port)]
+            else:
+                env['TAP_BIND'] = f'127.0.0.1:{port}'
+                if args.workers:
+                    env['TAP_WORKERS'] = str(args.workers)
+                if args.threads:
+                    env['TAP_THREADS'] = str(args.threads)
+                command = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+                           'wsgi:app']
+            print(f'== {name} ==')
+            results[name] = run_server(name, command, port, workdir, env, args)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print()
+    print(f"{'server':<10}{'reqs':>8}{'errors':>8}{'req/s':>9}")
+    for name, summary in results.items():
+        print(f"{name:<10}{summary['requests']:>8}{summary['errors']:>8}{summary['throughput']:>9}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'commit': git_commit(), 'clients': args.clients, 'duration': args.duration,
+                       'results': results}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
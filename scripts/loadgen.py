@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# loadgen.py - Simulate a fleet of ESP32 tap devices and report API latency
+#
+# Usage:
+#   python scripts/loadgen.py --clients 50 --duration 30 --output results.json
+#   python scripts/loadgen.py --url http://beerpi.local:5000 --clients 20
+#
+# Without --url the load runs in-process through Flask's test client against a
+# throwaway database seeded with one tap per client. With --url it drives a
+# running server over HTTP keep-alive, using the taps that server already has.
+#
+# Each virtual device loops over a weighted mix of what the real firmware does:
+# conditional tap info polls, resized image fetches, pour start/stop bursts and
+# update_volume calls. Results are printed per endpoint and can be saved as
+# JSON to compare runs between commits.
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DISPLAY_SIZE = 240
+
+# Relative weight of each device action per loop iteration
+ACTION_WEIGHTS = {
+    'poll': 60,
+    'image': 15,
+    'pour': 20,
+    'update_volume': 5,
+}
+
+
+class TestClientTransport:
+    """Sends requests in-process through Flask's test client"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None, headers=None):
+        response = self.client.open(path, method=method, json=body, headers=headers or {})
+        return response.status_code, response.headers.get('ETag'), len(response.data)
+
+
+class HTTPTransport:
+    """Sends requests to a running server over one keep-alive connection"""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.conn = None
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        data = None
+        if body is not None:
+            data = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            try:
+                self.conn.request(method, path, body=data, headers=headers)
+                response = self.conn.getresponse()
+                payload = response.read()
+                return response.status, response.getheader('ETag'), len(payload)
+            except (http.client.HTTPException, OSError):
+                # Server closed the keep-alive connection, retry once on a new one
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+
+
+class Recorder:
+    """Collects per-endpoint latencies and error counts from every client thread"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, endpoint, seconds, ok):
+        with self.lock:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+
+def timed(recorder, endpoint, transport, method, path, body=None, headers=None, ok_statuses=(200,)):
+    start = time.perf_counter()
+    try:
+        status, etag, _ = transport.request(method, path, body, headers)
+        ok = status in ok_statuses
+    except Exception:
+        status, etag, ok = None, None, False
+    recorder.record(endpoint, time.perf_counter() - start, ok)
+    return status, etag
+
+
+def run_device(transport, tap_id, recorder, stop_at, think, seed):
+    """One virtual tap device, looping until stop_at"""
+    rng = random.Random(seed)
+    actions = list(ACTION_WEIGHTS)
+    weights = [ACTION_WEIGHTS[action] for action in actions]
+    size = f'width={DISPLAY_SIZE}&height={DISPLAY_SIZE}'
+    etag = None
+
+    while time.monotonic() < stop_at:
+        action = rng.choices(actions, weights)[0]
+        if action == 'poll':
+            headers = {'If-None-Match': etag} if etag else {}
+            status, new_etag = timed(recorder, 'get_tap_info', transport, 'GET', f'/api/tap/{tap_id}?{size}',
+                                     headers=headers, ok_statuses=(200, 304))
+            if status == 200:
+                etag = new_etag
+        elif action == 'image':
+            timed(recorder, 'get_tap_image', transport, 'GET', f'/api/tap/{tap_id}/image?{size}')
+        elif action == 'pour':
+            timed(recorder, 'pour_event_start', transport, 'POST', f'/api/tap/{tap_id}/pour_event',
+                  body={'event_type': 'start'})
+            timed(recorder, 'pour_event_stop', transport, 'POST', f'/api/tap/{tap_id}/pour_event',
+                  body={'event_type': 'stop', 'duration': round(rng.uniform(0.01, 0.2), 3)})
+        else:
+            timed(recorder, 'update_volume', transport, 'POST', f'/api/tap/{tap_id}/update_volume',
+                  body={'pour_time': round(rng.uniform(0.01, 0.2), 3)})
+
+        if think:
+            time.sleep(rng.uniform(0, think))
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(recorder, elapsed):
+    endpoints = {}
+    for endpoint, values in sorted(recorder.latencies.items()):
+        values = sorted(values)
+        endpoints[endpoint] = {
+            'requests': len(values),
+            'errors': recorder.errors.get(endpoint, 0),
+            'throughput': round(len(values) / elapsed, 1),
+            'p50_ms': round(percentile(values, 50) * 1000, 2),
+            'p95_ms': round(percentile(values, 95) * 1000, 2),
+            'p99_ms': round(percentile(values, 99) * 1000, 2),
+        }
+    total = sum(e['requests'] for e in endpoints.values())
+    return {
+        'elapsed_seconds': round(elapsed, 2),
+        'requests': total,
+        'errors': sum(e['errors'] for e in endpoints.values()),
+        'throughput': round(total / elapsed, 1),
+        'endpoints': endpoints,
+    }
+
+
+def print_summary(summary):
+    print(f"{'endpoint':<18}{'reqs':>8}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for endpoint, stats in summary['endpoints'].items():
+        print(f"{endpoint:<18}{stats['requests']:>8}{stats['errors']:>8}{stats['throughput']:>9}"
+              f"{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}")
+    print(f"{'total':<18}{summary['requests']:>8}{summary['errors']:>8}{summary['throughput']:>9}")
+
+
+def seed_workdir(workdir, taps, database='beer_taps.db'):
+    """Fill a scratch directory with the schema, a label image and a database of taps"""
+    import sqlite3
+    from PIL import Image
+
+    for name in ('schema.sql', 'seed.sql'):
+        shutil.copy(os.path.join(ROOT, name), workdir)
+    os.makedirs(os.path.join(workdir, 'static', 'beer_images'))
+    # A phone-camera sized label, so image misses cost what they do in production
+    Image.new('RGB', (3000, 4000), (180, 120, 40)).save(
+        os.path.join(workdir, 'static', 'beer_images', 'default.jpg'), quality=90)
+
+    path = os.path.join(workdir, database)
+    conn = sqlite3.connect(path)
+    for name in ('schema.sql', 'seed.sql'):
+        with open(os.path.join(workdir, name)) as f:
+            conn.executescript(f.read())
+    conn.execute('DELETE FROM taps')
+    conn.executemany('INSERT INTO taps (tap_id, beer_id, volume, full_volume, flow_rate, version) '
+                     'VALUES (?, 1, 1e9, 1e9, 15.0, ?)',
+                     [(f'tap_{i + 1}', i + 1) for i in range(taps)])
+    conn.commit()
+    conn.close()
+    return path
+
+
+def setup_local_app(workdir, taps):
+    """Import app.py inside a scratch directory seeded with taps and a label image"""
+    database = seed_workdir(workdir, taps)
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    import app as tap_app
+
+    tap_app.app.config['DATABASE'] = database
+    return tap_app
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate a fleet of tap devices and report API latency')
+    parser.add_argument('--url', help='base URL of a running server; default runs in-process')
+    parser.add_argument('--clients', type=int, default=20, help='number of virtual devices')
+    parser.add_argument('--duration', type=float, default=20, help='seconds to run')
+    parser.add_argument('--think', type=float, default=0.05,
+                        help='max random pause between a device\'s requests, in seconds')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    if args.output:
+        # Resolve before the in-process mode switches to its scratch directory
+        args.output = os.path.abspath(args.output)
+
+    workdir = None
+    if args.url:
+        parts = urlsplit(args.url)
+        conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+        conn.request('GET', '/api/taps?fields=tap_id')
+        tap_ids = [tap['tap_id'] for tap in json.loads(conn.getresponse().read())['taps']]
+        conn.close()
+        if not tap_ids:
+            sys.exit('The server has no taps to load')
+        make_transport = lambda: HTTPTransport(args.url)
+    else:
+        workdir = tempfile.mkdtemp(prefix='loadgen-')
+        tap_app = setup_local_app(workdir, args.clients)
+        tap_ids = [f'tap_{i + 1}' for i in range(args.clients)]
+        make_transport = lambda: TestClientTransport(tap_app.app)
+
+    recorder = Recorder()
+    stop_at = time.monotonic() + args.duration
+    threads = [threading.Thread(target=run_device,
+                                args=(make_transport(), tap_ids[i % len(tap_ids)], recorder, stop_at,
+                                      args.think, args.seed + i))
+               for i in range(args.clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    summary = summarize(recorder, time.perf_counter() - start)
+
+    if workdir:
+        tap_app.pour_writer.close()
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_summary(summary)
+    if args.output:
+        result = {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'target': args.url or 'test_client',
+            'clients': args.clients,
+            'duration': args.duration,
+            'think': args.think,
+            'summary': summary,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -9,7 +9,7 @@ sudo apt update && sudo apt upgrade -y
 
 # Install required system dependencies
 echo "Installing dependencies..."
-sudo apt install -y python3-pip python3-venv python3-dev
+sudo apt install -y python3-pip python3-venv python3-dev fonts-dejavu-core
 
 # Create project directory
 mkdir -p ~/keg_tap_server
@@ -22,7 +22,7 @@ source venv/bin/activate
 
 # Install Python dependencies
 echo "Installing Python packages..."
-pip install flask werkzeug Pillow
+pip install flask werkzeug Pillow gunicorn
 
 # Create directory structure
 mkdir -p static/beer_images
@@ -44,7 +44,8 @@ cat > start.sh << EOF
 #!/bin/bash
 cd ~/keg_tap_server
 source venv/bin/activate
-python app.py
+flask --app app init-db
+exec gunicorn -c gunicorn.conf.py wsgi:app
 EOF
 
 # Make startup script executable
@@ -61,6 +62,9 @@ After=network.target
 User=$USER
 WorkingDirectory=/home/$USER/keg_tap_server
 ExecStart=/home/$USER/keg_tap_server/start.sh
+ExecReload=/bin/kill -s HUP \$MAINPID
+KillMode=mixed
+TimeoutStopSec=70
 Restart=always
 RestartSec=10
 
@@ -82,4 +86,5 @@ echo ""
 echo "To check service status: sudo systemctl status keg_tap_server.service"
 echo "To manually start the service: sudo systemctl start keg_tap_server.service"
 echo "To manually stop the service: sudo systemctl stop keg_tap_server.service"
+echo "To reload after an update without dropping devices: sudo systemctl reload keg_tap_server.service"
 echo "To view logs: sudo journalctl -u keg_tap_server.service"
\ No newline at end of file
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# stress_pours.py - Fire many simultaneous pours at one tap and check none are lost
+#
+# Usage: python scripts/stress_pours.py [--pours 500] [--threads 64]
+#
+# Runs against a throwaway copy of the database through Flask's test client.
+# Exits non-zero if the final keg volume doesn't account for every pour.
+import argparse
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import app as tap_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pours', type=int, default=500, help='number of pours to fire')
+    parser.add_argument('--threads', type=int, default=64, help='concurrent client threads')
+    parser.add_argument('--duration', type=float, default=0.5, help='seconds per pour')
+    args = parser.parse_args()
+    args.threads = min(args.threads, args.pours)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tap_app.app.config['DATABASE'] = os.path.join(tmp, 'stress.db')
+        tap_app.init_db()
+
+        conn = tap_app.get_db_connection()
+        start = conn.execute("SELECT volume, flow_rate FROM taps WHERE tap_id = 'tap_1'").fetchone()
+        # Make sure the keg can't run dry, which would hide lost decrements behind the clamp at zero
+        full = args.pours * args.duration * start['flow_rate'] * 2
+        conn.execute("UPDATE taps SET volume = ? WHERE tap_id = 'tap_1'", (full,))
+        conn.commit()
+
+        barrier = threading.Barrier(args.threads)
+        client_local = threading.local()
+
+        def pour(i):
+            client = getattr(client_local, 'client', None)
+            if client is None:
+                client = client_local.client = tap_app.app.test_client()
+                barrier.wait()
+            # Alternate between the two pour endpoints, they must not lose each other's writes either
+            if i % 2:
+                response = client.post('/api/tap/tap_1/pour_event',
+                                       json={'event_type': 'stop', 'duration': args.duration})
+            else:
+                response = client.post('/api/tap/tap_1/update_volume', json={'pour_time': args.duration})
+            return response.status_code
+
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            statuses = list(pool.map(pour, range(args.pours)))
+
+        conn = tap_app.get_db_connection()
+        final = conn.execute("SELECT volume FROM taps WHERE tap_id = 'tap_1'").fetchone()['volume']
+
+    errors = sum(1 for status in statuses if status != 200)
+    expected = full - args.pours * args.duration * start['flow_rate']
+    lost = round((final - expected) / (args.duration * start['flow_rate']))
+    print(f"pours: {args.pours}  errors: {errors}  expected volume: {expected}  final volume: {final}  lost pours: {lost}")
+    if errors or abs(final - expected) > 1e-6:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,10 @@
+-- Sample data for a freshly initialized Keg Tap database
+
+INSERT INTO beers (name, abv, image_path) VALUES
+                                              ('IPA', 6.5, 'beer_images/default.jpg'),
+                                              ('Stout', 5.0, 'beer_images/default.jpg'),
+                                              ('Pilsner', 4.2, 'beer_images/default.jpg');
+
+INSERT INTO taps (tap_id, beer_id, volume, full_volume, flow_rate, version, updated_at) VALUES
+                                                          ('tap_1', 1, 5000, 5000, 15.0, 1, CAST(strftime('%s', 'now') AS INTEGER)),  -- 5 liters of IPA, flowing at 15ml/sec
+                                                          ('tap_2', 2, 5000, 5000, 12.0, 2, CAST(strftime('%s', 'now') AS INTEGER));  -- 5 liters of Stout, flowing at 12ml/sec
@@ -0,0 +1,86 @@
+# tap_cache.py - In-process cache of tap state for the device read path
+import threading
+import time
+
+
+class TapCache:
+    """Joined tap + beer rows, plus their serialized API responses, kept in memory.
+
+    Every tap write stamps the row with a new, increasing version, so the
+    cache stays current by loading the rows whose version is above the
+    highest one it has seen. Writers in this process call sync(force=True)
+    after committing (write-through). Reads only re-check the database once
+    per sync_interval, which bounds how stale writes made by other worker
+    processes can be.
+    """
+
+    def __init__(self, since_query, sync_interval=0.5):
+        self.since_query = since_query  # rows joined like TAP_INFO_QUERY with version > ?
+        self.sync_interval = sync_interval
+        self.version = -1
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._taps = {}       # tap_id -> row dict
+        self._tap_ids = {}    # taps.id -> tap_id, to drop renamed taps
+        self._rendered = {}   # tap_id -> (row, {key: bytes})
+        self._synced_at = 0.0
+
+    def sync(self, conn, force=False):
+        """Load every tap that changed since the last sync"""
+        now = time.monotonic()
+        if not force and now - self._synced_at < self.sync_interval:
+            return
+
+        rows = conn.execute(self.since_query, (self.version,)).fetchall()
+        with self._lock:
+            for row in rows:
+                self._store(dict(row))
+            self._synced_at = now
+
+    def _store(self, row):
+        current = self._taps.get(row['tap_id'])
+        if current is not None and current['version'] >= row['version']:
+            return
+        old_tap_id = self._tap_ids.get(row['id'])
+        if old_tap_id is not None and old_tap_id != row['tap_id']:
+            self._taps.pop(old_tap_id, None)
+            self._rendered.pop(old_tap_id, None)
+        self._tap_ids[row['id']] = row['tap_id']
+        self._taps[row['tap_id']] = row
+        self.version = max(self.version, row['version'])
+
+    def get(self, conn, tap_id):
+        """Return the row for tap_id as a dict, or None if there is no such tap"""
+        self.sync(conn)
+        tap = self._taps.get(tap_id)
+        if tap is None:
+            # Might have been added by another worker since our last sync
+            self.misses += 1
+            self.sync(conn, force=True)
+            return self._taps.get(tap_id)
+        self.hits += 1
+        return tap
+
+    def rendered(self, tap, key, build):
+        """Return (body, complete) for a cached row, memoized under key until the row changes.
+
+        build() returns the same pair. A body that isn't complete (one built
+        around a missing image, say) is handed back but never memoized, so
+        the next request builds it again.
+        """
+        entry = self._rendered.get(tap['tap_id'])
+        if entry is None or entry[0] is not tap:
+            entry = (tap, {})
+            self._rendered[tap['tap_id']] = entry
+        body = entry[1].get(key)
+        if body is not None:
+            return body, True
+        body, complete = build()
+        if complete:
+            entry[1][key] = body
+        return body, complete
+
+    def stats(self):
+        """Hit/miss counters for monitoring"""
+        return {'hits': self.hits, 'misses': self.misses, 'taps': len(self._taps), 'version': self.version}
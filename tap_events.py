@@ -0,0 +1,47 @@
+# tap_events.py - Change notifications for the device push/long-poll channel
+import os
+import threading
+import time
+
+
+class TapNotifier:
+    """Wakes requests that are waiting for a tap to change.
+
+    Writers in this process call notify() after they commit. Waiters also
+    re-run their check every poll_interval seconds, which picks up writes
+    committed by other worker processes.
+    """
+
+    def __init__(self, poll_interval=1.0):
+        self.poll_interval = poll_interval
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._cond = threading.Condition()
+        self._generation = 0
+
+    def notify(self):
+        """Wake every waiter so it re-runs its check"""
+        with self._cond:
+            self._generation += 1
+            self._cond.notify_all()
+
+    def wait_for(self, check, timeout):
+        """Call check() until it returns something truthy, or return None after timeout seconds"""
+        deadline = time.monotonic() + timeout
+        while True:
+            # Read the generation before checking so a notify() that lands
+            # between the check and the wait isn't missed
+            with self._cond:
+                generation = self._generation
+            result = check()
+            if result:
+                return result
+
+            remaining = deadline - time.monotonic()
+            if not remaining > 0:  # also stops a NaN timeout from spinning forever
+                return None
+            with self._cond:
+                if self._generation == generation:
+                    self._cond.wait(min(remaining, self.poll_interval))
@@ -0,0 +1,71 @@
+# test_pours.py - Concurrent pours must each take their volume off the keg exactly once
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+POURS = 200
+THREADS = 32
+DURATION = 0.5
+
+
+@pytest.fixture
+def tap_app(tmp_path, monkeypatch):
+    """The app on a fresh database, with its own tap cache and pour writer"""
+    monkeypatch.chdir(ROOT)  # schema.sql and the upload folder are relative paths
+    import app as tap_app
+    from pour_writer import PourWriter
+    from tap_cache import TapCache
+
+    monkeypatch.setitem(tap_app.app.config, 'DATABASE', str(tmp_path / 'pours.db'))
+    monkeypatch.setattr(tap_app, 'tap_cache', TapCache(tap_app.TAPS_SINCE_QUERY))
+    writer = PourWriter(tap_app.get_db_connection, tap_app.apply_pour,
+                        flush_interval_ms=tap_app.app.config['POUR_FLUSH_INTERVAL_MS'],
+                        max_batch=tap_app.app.config['POUR_FLUSH_MAX_EVENTS'])
+    monkeypatch.setattr(tap_app, 'pour_writer', writer)
+    tap_app.init_db()
+    yield tap_app
+    writer.close()
+
+
+@pytest.mark.parametrize('group_commit', [True, False])
+def test_concurrent_pours_lose_no_volume(tap_app, monkeypatch, group_commit):
+    monkeypatch.setitem(tap_app.app.config, 'POUR_GROUP_COMMIT', group_commit)
+    conn = tap_app.get_db_connection()
+    flow_rate = conn.execute("SELECT flow_rate FROM taps WHERE tap_id = 'tap_1'").fetchone()['flow_rate']
+    # Enough that the keg can't run dry, which would hide lost decrements behind the clamp at zero
+    full = POURS * DURATION * flow_rate * 2
+    conn.execute("UPDATE taps SET volume = ? WHERE tap_id = 'tap_1'", (full,))
+    conn.commit()
+
+    barrier = threading.Barrier(THREADS)
+    client_local = threading.local()
+
+    def pour(i):
+        client = getattr(client_local, 'client', None)
+        if client is None:
+            client = client_local.client = tap_app.app.test_client()
+            barrier.wait()
+        # Alternate between the two pour endpoints, they must not lose each other's writes either
+        if i % 2:
+            response = client.post('/api/tap/tap_1/pour_event', json={'event_type': 'stop', 'duration': DURATION})
+        else:
+            response = client.post('/api/tap/tap_1/update_volume', json={'pour_time': DURATION})
+        return response.status_code
+
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        statuses = list(pool.map(pour, range(POURS)))
+
+    assert statuses == [200] * POURS
+    expected = full - POURS * DURATION * flow_rate
+    conn = tap_app.get_db_connection()
+    assert conn.execute("SELECT volume FROM taps WHERE tap_id = 'tap_1'").fetchone()['volume'] == pytest.approx(expected)
+    assert conn.execute("SELECT COUNT(*) FROM pours WHERE tap_id = 'tap_1'").fetchone()[0] == POURS
+    # The device read path must see the same volume through the tap cache
+    tap = tap_app.app.test_client().get('/api/tap/tap_1').get_json()
+    assert tap['volume'] == pytest.approx(expected)
@@ -0,0 +1,5 @@
+# wsgi.py - WSGI entry point for running the Keg Tap server under gunicorn
+#
+#   flask --app app init-db
+#   gunicorn -c gunicorn.conf.py wsgi:app
+from app import app  # noqa: F401